@@ -1,11 +1,8 @@
 import fitz
 
 def get_text_from_odf(path): 
-    text = ""
     with fitz.open(path) as pdf: 
-        for page in pdf: 
-            text += page.get_text()
-    return text
+        return "".join(page.get_text("text", flags=fitz.TEXT_MEDIABOX_CLIP) for page in pdf)
 
 if __name__ == "__main__":
     pdf_path = "" #change this to correct path
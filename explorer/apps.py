@@ -1,5 +1,31 @@
+import os
+import sys
+import threading
+
 from django.apps import AppConfig
 
+
+def _warm_models():
+    """Load the search models in the background (imported here so startup isn't blocked)."""
+    from semantic_index.search import warmup
+    warmup()
+
+
 class ExplorerConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'explorer'
+
+    def ready(self):
+        # Warm the embedding model + reranker off the request path.
+        # Opt out with SEMANTIC_WARMUP=0.
+        if os.getenv("SEMANTIC_WARMUP", "1") == "0":
+            return
+        # Only warm up in processes that serve requests: skip other management
+        # commands (migrate, shell, ...) and runserver's autoreloader parent.
+        if sys.argv and sys.argv[0].endswith("manage.py"):
+            command = sys.argv[1] if len(sys.argv) > 1 else ""
+            if command != "runserver":
+                return
+            if "--noreload" not in sys.argv and os.environ.get("RUN_MAIN") != "true":
+                return
+        threading.Thread(target=_warm_models, name="semantic-warmup", daemon=True).start()
@@ -1,3 +1,1036 @@
-from django.test import TestCase
+import json
+import os
+import random
+import tempfile
+import threading
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.test import AsyncRequestFactory, RequestFactory, SimpleTestCase
+
+from . import views_open, views_reindex, views_search
+from .views_search import _decode_cursor, _encode_cursor, _get_int
+
+
+class SafePathTests(SimpleTestCase):
+    """_is_safe_path only accepts paths that resolve inside an allowed directory."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.base = Path(tmp.name).resolve() / "project"
+        self.outside = Path(tmp.name).resolve() / "outside"
+        for directory in ["documents1", "documents2", "secret"]:
+            (self.base / directory).mkdir(parents=True)
+        self.outside.mkdir()
+        (self.base / "documents1" / "a.txt").write_text("a")
+        (self.base / "secret" / "b.txt").write_text("b")
+        (self.outside / "c.txt").write_text("c")
+        prefixes = tuple((self.base / d).as_posix() + "/" for d in views_open.ALLOWED_DIRECTORIES)
+        for name, value in [
+            ("BASE_DIR", self.base),
+            ("_BASE_RESOLVED", self.base),
+            ("_ALLOWED_RESOLVED_PREFIXES", prefixes),
+        ]:
+            patcher = mock.patch.object(views_open, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_allowed(self):
+        self.assertEqual(
+            views_open._is_safe_path("documents1/a.txt"),
+            (True, self.base / "documents1" / "a.txt"),
+        )
+        self.assertEqual(views_open._is_safe_path("documents2"), (True, self.base / "documents2"))
+
+    def test_rejected(self):
+        for path in [
+            "secret/b.txt",
+            "documents1/../secret/b.txt",
+            "documents1/../../outside/c.txt",
+            "../project/documents1/a.txt",
+            "/etc/passwd",
+            "",
+        ]:
+            with self.subTest(path=path):
+                self.assertEqual(views_open._is_safe_path(path), (False, None))
+
+    def test_prefix_must_end_at_directory_boundary(self):
+        (self.base / "documents10").mkdir()
+        (self.base / "documents10" / "d.txt").write_text("d")
+        for path in ["documents10/d.txt", "documents1x", "documents1.txt"]:
+            with self.subTest(path=path):
+                self.assertEqual(views_open._is_safe_path(path), (False, None))
+
+    def test_symlink_out_of_allowed_directory(self):
+        link = self.base / "documents1" / "link.txt"
+        try:
+            os.symlink(self.outside / "c.txt", link)
+        except (OSError, NotImplementedError):
+            self.skipTest("symlinks not supported")
+        self.assertEqual(views_open._is_safe_path("documents1/link.txt"), (False, None))
+
+
+
+class FakeFitz:
+    """Stands in for PyMuPDF; every call checks that views_open._fitz_lock is held."""
+
+    TEXT_MEDIABOX_CLIP = 64
+
+    def __init__(self, test, pages=3):
+        self.test = test
+        self.pages = pages
+        self.opened = []
+
+    def check_lock(self):
+        self.test.assertTrue(views_open._fitz_lock.locked(), "PyMuPDF called without _fitz_lock")
+
+    def open(self, path):
+        self.check_lock()
+        doc = FakeDocument(self, path)
+        self.opened.append(doc)
+        return doc
+
+
+class FakeDocument:
+    def __init__(self, fitz, path):
+        self.fitz = fitz
+        self.name = Path(path).name
+        self.closed = False
+
+    def __len__(self):
+        self.fitz.check_lock()
+        return self.fitz.pages
+
+    def __getitem__(self, page_num):
+        self.fitz.check_lock()
+        return FakePage(self, page_num)
+
+    def close(self):
+        self.fitz.check_lock()
+        self.closed = True
+
+
+class FakePage:
+    def __init__(self, doc, page_num):
+        self.doc = doc
+        self.page_num = page_num
+
+    def get_text(self, kind, flags):
+        self.doc.fitz.check_lock()
+        self.doc.fitz.test.assertFalse(self.doc.closed)
+        return f"{self.doc.name}:{self.page_num};"
+
+
+class PdfPreviewCacheTests(SimpleTestCase):
+    """PDF previews reuse parsed documents and only touch PyMuPDF under _fitz_lock."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = Path(tmp.name)
+        self.fitz = FakeFitz(self)
+        for name, value in [
+            ("_get_fitz", lambda: self.fitz),
+            ("_pdf_cache", views_open.OrderedDict()),
+            ("PDF_CACHE_MAXSIZE", 2),
+        ]:
+            patcher = mock.patch.object(views_open, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _pdf(self, name):
+        path = self.dir / name
+        path.write_bytes(b"%PDF")
+        return path
+
+    def test_repeat_preview_reuses_document(self):
+        path = self._pdf("a.pdf")
+        for _ in range(2):
+            result = views_open._read_pdf_preview(path)
+            self.assertEqual(result["content"], "a.pdf:0;a.pdf:1;a.pdf:2;")
+            self.assertEqual((result["pages"], result["preview_pages"]), (3, 3))
+        self.assertEqual(len(self.fitz.opened), 1)
+
+    def test_evicted_documents_are_closed(self):
+        paths = [self._pdf(f"{name}.pdf") for name in "abc"]
+        for path in paths:
+            views_open._read_pdf_preview(path)
+        self.assertEqual([doc.closed for doc in self.fitz.opened], [True, False, False])
+        # The evicted document is reopened on its next preview
+        self.assertEqual(views_open._read_pdf_preview(paths[0])["content"], "a.pdf:0;a.pdf:1;a.pdf:2;")
+        self.assertEqual(len(self.fitz.opened), 4)
+
+    def test_modified_file_is_reopened(self):
+        path = self._pdf("a.pdf")
+        views_open._read_pdf_preview(path)
+        stat = path.stat()
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+        views_open._read_pdf_preview(path)
+        self.assertEqual(len(self.fitz.opened), 2)
+
+
+
+class OpenStreamTests(SimpleTestCase):
+    """/api/open/stream hands WSGI sync iterators and ASGI async ones."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = Path(tmp.name)
+        self.fitz = FakeFitz(self, pages=views_open.PREVIEW_PAGES + 2)
+        for name, value in [
+            ("_get_fitz", lambda: self.fitz),
+            ("_pdf_cache", views_open.OrderedDict()),
+            ("_is_safe_path", lambda path: (True, self.dir / path)),
+            ("STREAM_BLOCK_SIZE", 4),
+        ]:
+            patcher = mock.patch.object(views_open, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        (self.dir / "a.txt").write_bytes("héllo wörld".encode("utf-8"))
+        (self.dir / "b.pdf").write_bytes(b"%PDF")
+
+    def _stream(self, factory, path):
+        request = factory.get("/api/open/stream", {"path": path})
+        return async_to_sync(views_open.api_open_stream)(request)
+
+    def _collect_async(self, response):
+        async def collect():
+            return [chunk async for chunk in response.streaming_content]
+
+        return async_to_sync(collect)()
+
+    def test_wsgi_gets_sync_iterators(self):
+        response = self._stream(RequestFactory(), "a.txt")
+        self.assertFalse(response.is_async)
+        chunks = list(response.streaming_content)
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(b"".join(chunks).decode("utf-8"), "héllo wörld")
+
+        response = self._stream(RequestFactory(), "b.pdf")
+        self.assertFalse(response.is_async)
+        pages = list(response.streaming_content)
+        self.assertEqual(len(pages), views_open.PREVIEW_PAGES)
+        self.assertEqual(pages[0], b"b.pdf:0;")
+
+    def test_asgi_gets_async_iterators(self):
+        response = self._stream(AsyncRequestFactory(), "a.txt")
+        self.assertTrue(response.is_async)
+        self.assertEqual(b"".join(self._collect_async(response)).decode("utf-8"), "héllo wörld")
+
+        response = self._stream(AsyncRequestFactory(), "b.pdf")
+        self.assertTrue(response.is_async)
+        self.assertEqual(len(self._collect_async(response)), views_open.PREVIEW_PAGES)
+
+    def test_stream_uses_document_cache(self):
+        views_open._read_pdf_preview(self.dir / "b.pdf")
+        list(self._stream(RequestFactory(), "b.pdf").streaming_content)
+        self.assertEqual(len(self.fitz.opened), 1)
+
+
+class ReindexStatusETagTests(SimpleTestCase):
+    """Unchanged progress is answered with an empty 304."""
+
+    job = {
+        "job_id": "j1",
+        "status": "indexing",
+        "current": 3,
+        "total": 12,
+        "phase": "reading",
+        "updated_at": "2024-01-01T12:00:00",
+    }
+
+    def _status(self, job, **headers):
+        request = RequestFactory().get("/api/reindex/status", {"job_id": "j1"}, **headers)
+        with mock.patch.object(views_reindex, "get_job", return_value=job):
+            return views_reindex.api_reindex_status(request)
+
+    def test_etag_round_trip(self):
+        response = self._status(dict(self.job))
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+        self.assertEqual(response["Cache-Control"], "no-cache")
+
+        response = self._status(dict(self.job), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+        self.assertEqual(response["ETag"], etag)
+
+    def test_progress_change_returns_body(self):
+        etag = self._status(dict(self.job))["ETag"]
+        response = self._status(dict(self.job, current=4), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_unknown_job(self):
+        self.assertEqual(self._status(None).status_code, 404)
+
+
+class ReindexEventsTests(SimpleTestCase):
+    """The SSE stream is sync under WSGI and async under ASGI, so neither buffers it."""
+
+    jobs = [
+        {"job_id": "j1", "status": "indexing", "current": 1, "phase": "reading", "updated_at": "t1"},
+        {"job_id": "j1", "status": "indexing", "current": 1, "phase": "reading", "updated_at": "t1"},
+        {"job_id": "j1", "status": "completed", "current": 2, "phase": "completed", "updated_at": "t2"},
+    ]
+
+    def setUp(self):
+        # First call is the view's existence check, then one per poll
+        get_job = mock.patch.object(views_reindex, "get_job", side_effect=[self.jobs[0]] + self.jobs)
+        get_job.start()
+        self.addCleanup(get_job.stop)
+        interval = mock.patch.object(views_reindex, "EVENTS_POLL_INTERVAL", 0)
+        interval.start()
+        self.addCleanup(interval.stop)
+
+    def _events(self, content):
+        return [json.loads(event[len("data: "):]) for event in b"".join(content).decode().split("\n\n") if event]
+
+    def test_wsgi_gets_sync_stream(self):
+        request = RequestFactory().get("/api/reindex/events", {"job_id": "j1"})
+        response = async_to_sync(views_reindex.api_reindex_events)(request)
+        self.assertFalse(response.is_async)
+        # Unchanged progress isn't sent twice
+        self.assertEqual(self._events(response.streaming_content), [self.jobs[0], self.jobs[2]])
+
+    def test_asgi_gets_async_stream(self):
+        request = AsyncRequestFactory().get("/api/reindex/events", {"job_id": "j1"})
+        response = async_to_sync(views_reindex.api_reindex_events)(request)
+        self.assertTrue(response.is_async)
+
+        async def collect():
+            return [chunk async for chunk in response.streaming_content]
+
+        self.assertEqual(self._events(async_to_sync(collect)()), [self.jobs[0], self.jobs[2]])
+
+
+class QueryParameterTests(SimpleTestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def _get_int(self, query, **kwargs):
+        return _get_int(self.factory.get("/api/search", query), "k", **kwargs)
+
+    def test_get_int(self):
+        self.assertEqual(self._get_int({}, default=5, lo=1, hi=50), 5)
+        self.assertEqual(self._get_int({"k": "7"}, default=5, lo=1, hi=50), 7)
+        self.assertEqual(self._get_int({"k": " 7 "}, default=5, lo=1, hi=50), 7)
+        self.assertEqual(self._get_int({"k": "0"}, default=5, lo=1, hi=50), 1)
+        self.assertEqual(self._get_int({"k": "500"}, default=5, lo=1, hi=50), 50)
+        self.assertEqual(self._get_int({"k": "500"}, default=5, lo=1), 500)
+        self.assertEqual(self._get_int({"k": "999999999"}, default=5, lo=1), 999999999)
+
+    def test_get_int_malformed(self):
+        for value in ["", "-3", "1.5", "abc", "²", "١٢", "7e2", "1" * 10, "9" * 5000]:
+            with self.subTest(value=value):
+                self.assertEqual(self._get_int({"k": value}, default=5, lo=1, hi=50), 5)
+
+    def test_cursor_round_trip(self):
+        for offset in [0, 5, 195]:
+            self.assertEqual(_decode_cursor(_encode_cursor(offset)), offset)
+
+    def test_decode_cursor_malformed(self):
+        for cursor in ["", "!!!", "YWJj", "²"]:  # "YWJj" is base64 for "abc"
+            with self.subTest(cursor=cursor):
+                self.assertIsNone(_decode_cursor(cursor))
+
+
+class ChunkingTests(SimpleTestCase):
+    """Streaming chunker must produce exactly the same chunks as chunking the joined text."""
+
+    def test_iter_chunks_from_parts_matches_chunk_text(self):
+        from semantic_index.extract import _chunk_text, _iter_chunks_from_parts
+
+        rng = random.Random(0)
+        for _ in range(500):
+            size = rng.randint(2, 50)
+            overlap = rng.randint(0, size - 1)
+            text = "".join(rng.choice("ab ") for _ in range(rng.randint(0, 300)))
+            # Split the text into random pieces (like PDF pages of varying length)
+            parts, pos = [], 0
+            while pos < len(text):
+                end = pos + rng.randint(1, 80)
+                parts.append(text[pos:end])
+                pos = end
+            with self.subTest(size=size, overlap=overlap, text=text):
+                self.assertEqual(
+                    list(_iter_chunks_from_parts(parts, size, overlap)),
+                    _chunk_text(text, size, overlap),
+                )
+
+    def test_empty_text_has_no_chunks(self):
+        from semantic_index.extract import _chunk_text, _iter_chunks_from_parts
+
+        self.assertEqual(_chunk_text(""), [])
+        self.assertEqual(list(_iter_chunks_from_parts([])), [])
+        self.assertEqual(list(_iter_chunks_from_parts(["", ""])), [])
+
+
+class RerankOrderTests(SimpleTestCase):
+    """Pairs are scored in length order, but each score must land on its own result."""
+
+    def test_scores_follow_their_pairs(self):
+        from semantic_index import reranker
+
+        calls = []
+
+        class FakeReranker:
+            def compute_score(self, pairs, normalize, batch_size):
+                calls.append([text for _, text in pairs])
+                # Score is a function of the chunk text, so a mix-up shows in the results
+                return [1.0 / len(text) for _, text in pairs]
+
+        texts = {"a": "x" * 30, "b": "x" * 10, "c": "x" * 20, "d": "x" * 5}
+        results = [{"path": path} for path in texts]
+        with mock.patch.object(reranker, "_get_reranker", return_value=FakeReranker()):
+            ranked = reranker.rerank_files("q", results, texts, batch_size=2)
+
+        self.assertEqual(calls, [sorted(texts.values(), key=len)])
+        self.assertEqual([r["path"] for r in ranked], ["d", "b", "c", "a"])
+        for r in ranked:
+            self.assertAlmostEqual(r["rerank_score"], 1.0 / len(texts[r["path"]]))
+
+
+class ProgressStoreTests(SimpleTestCase):
+    """Job lifecycle against a throwaway SQLite progress store."""
+
+    def setUp(self):
+        from semantic_index import progress
+
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        for name, value in [
+            ("PROGRESS_DB", Path(tmp.name) / "progress.sqlite3"),
+            ("_local", threading.local()),
+            ("_last_write", {}),
+        ]:
+            patcher = mock.patch.object(progress, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(lambda: progress._connect().close())
+        self.progress = progress
+
+    def test_lifecycle(self):
+        progress = self.progress
+        job_id = progress.start_job("documents1")
+        job = progress.get_job(job_id)
+        self.assertEqual((job["status"], job["phase"], job["current"]), ("indexing", "starting", 0))
+        # Timestamps are stored as floats but read back as ISO strings
+        self.assertIsInstance(job["updated_at"], str)
+
+        progress.update_job(job_id, 3, 12, "documents1/a.pdf")
+        job = progress.get_job(job_id)
+        self.assertEqual((job["current"], job["total"], job["percent"]), (3, 12, 25.0))
+        self.assertEqual(job["current_file"], "documents1/a.pdf")
+
+        progress.finish_job(job_id, 12)
+        job = progress.get_job(job_id)
+        self.assertEqual((job["status"], job["percent"], job["current_file"]), ("completed", 100.0, None))
+
+        progress.clear_job(job_id)
+        self.assertIsNone(progress.get_job(job_id))
+
+    def test_fail_job(self):
+        job_id = self.progress.start_job("documents1")
+        self.progress.fail_job(job_id, "boom")
+        job = self.progress.get_job(job_id)
+        self.assertEqual((job["status"], job["error"]), ("error", "boom"))
+
+    def test_unknown_job(self):
+        self.assertIsNone(self.progress.get_job("missing"))
+        self.progress.update_job("missing", 1, 2)  # No-op, must not raise
+        self.assertIsNone(self.progress.get_job("missing"))
+
+    def test_repeat_updates_are_throttled(self):
+        progress = self.progress
+        job_id = progress.start_job("documents1")
+        with mock.patch.object(progress, "PROGRESS_MIN_INTERVAL", 60.0):
+            progress.update_job(job_id, 1, 4, "documents1/a.pdf")
+            # Same (current, total, phase) right away: only current_file differs, so skipped
+            progress.update_job(job_id, 1, 4, "documents1/b.pdf")
+            self.assertEqual(progress.get_job(job_id)["current_file"], "documents1/a.pdf")
+            # Any progress change is written immediately
+            progress.update_job(job_id, 2, 4, "documents1/b.pdf")
+            self.assertEqual(progress.get_job(job_id)["current"], 2)
+
+
+class MicroBatcherTests(SimpleTestCase):
+    """The shared batching worker behind the embedding and rerank batchers."""
+
+    def _batcher(self, process, window=0.2, max_batch=None):
+        from semantic_index.batching import MicroBatcher
+
+        batches = []
+
+        class Batcher(MicroBatcher):
+            def _window(self):
+                return window
+
+            def _max_batch(self):
+                return max_batch
+
+            def _process(self, items):
+                batches.append([item for item, _ in items])
+                process(items)
+
+        return Batcher(), batches
+
+    def test_items_within_window_share_a_batch(self):
+        def double(items):
+            for item, future in items:
+                future.set_result(item * 2)
+
+        batcher, batches = self._batcher(double)
+        futures = [batcher.submit(i) for i in range(3)]
+        self.assertEqual([f.result(timeout=5) for f in futures], [0, 2, 4])
+        self.assertEqual(batches, [[0, 1, 2]])
+
+    def test_max_batch_splits_batches(self):
+        def double(items):
+            for item, future in items:
+                future.set_result(item * 2)
+
+        batcher, batches = self._batcher(double, max_batch=2)
+        futures = [batcher.submit(i) for i in range(3)]
+        self.assertEqual([f.result(timeout=5) for f in futures], [0, 2, 4])
+        self.assertEqual(batches, [[0, 1], [2]])
+
+    def test_failure_resolves_remaining_futures_and_worker_survives(self):
+        def fail_after_first(items):
+            if items[0][0] == "ok":
+                items[0][1].set_result("done")
+                raise RuntimeError("boom")
+            for item, future in items:
+                future.set_result(item)
+
+        batcher, _ = self._batcher(fail_after_first)
+        first, second = batcher.submit("ok"), batcher.submit("lost")
+        self.assertEqual(first.result(timeout=5), "done")
+        with self.assertRaises(RuntimeError):
+            second.result(timeout=5)
+        self.assertEqual(batcher.submit("later").result(timeout=5), "later")
+
+
+class RerankBatcherTests(SimpleTestCase):
+    """Requests submitted together are scored in one call and split back per request."""
+
+    def setUp(self):
+        from semantic_index import reranker
+
+        self.reranker = reranker
+        self.calls = []
+        calls = self.calls
+
+        class FakeReranker:
+            def compute_score(self, pairs, normalize, batch_size):
+                calls.append((len(pairs), batch_size))
+                return [float(len(text)) for _, text in pairs]
+
+        for name, value in [
+            ("_get_reranker", mock.Mock(return_value=FakeReranker())),
+            # Wide window so both submissions land in the same batch
+            ("RERANK_BATCH_WINDOW", 0.2),
+        ]:
+            patcher = mock.patch.object(reranker, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_concurrent_requests_are_fused(self):
+        batcher = self.reranker._RerankBatcher()
+        first = batcher.submit([["q1", "xxx"], ["q1", "x"]], 32)
+        second = batcher.submit([["q2", "xx"]], 32)
+        self.assertEqual(first.result(timeout=5), [3.0, 1.0])
+        self.assertEqual(second.result(timeout=5), [2.0])
+        self.assertEqual(self.calls, [(3, 32)])
+
+    def test_batch_sizes_are_scored_separately(self):
+        batcher = self.reranker._RerankBatcher()
+        first = batcher.submit([["q1", "xxx"]], 32)
+        second = batcher.submit([["q2", "xx"]], 128)
+        self.assertEqual(first.result(timeout=5), [3.0])
+        self.assertEqual(second.result(timeout=5), [2.0])
+        self.assertEqual(sorted(self.calls), [(1, 32), (1, 128)])
+
+    def test_errors_reach_every_caller(self):
+        self.reranker._get_reranker.side_effect = RuntimeError("no model")
+        batcher = self.reranker._RerankBatcher()
+        futures = [batcher.submit([["q", "x"]], 32) for _ in range(2)]
+        for future in futures:
+            with self.assertRaises(RuntimeError):
+                future.result(timeout=5)
+
+
+class EmbedBatcherTests(SimpleTestCase):
+    """Concurrent query embeddings share one encode() call; each caller gets its own row."""
+
+    def setUp(self):
+        from semantic_index import search
+
+        self.search = search
+        self.calls = []
+        calls = self.calls
+
+        class FakeModel:
+            def encode(self, texts, **kwargs):
+                calls.append(list(texts))
+                return [[float(len(text)), 1.0] for text in texts]
+
+        for name, value in [
+            ("get_model", mock.Mock(return_value=FakeModel())),
+            # Wide window so all threads' queries land in the same batch
+            ("EMBED_BATCH_WINDOW", 0.2),
+        ]:
+            patcher = mock.patch.object(search, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _encode_concurrently(self, batcher, queries):
+        results = {}
+        errors = {}
+
+        def encode(query):
+            try:
+                results[query] = batcher.encode(query)
+            except Exception as e:
+                errors[query] = e
+
+        threads = [threading.Thread(target=encode, args=(q,)) for q in queries]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=5)
+        return results, errors
+
+    def test_concurrent_queries_are_batched(self):
+        queries = ["a", "bb", "ccc"]
+        results, _ = self._encode_concurrently(self.search._EmbedBatcher(), queries)
+        self.assertEqual(len(self.calls), 1)
+        self.assertCountEqual(self.calls[0], queries)
+        for query in queries:
+            emb = results[query]
+            self.assertEqual(emb.shape, (1, 2))
+            self.assertEqual(emb.dtype.name, "float32")
+            self.assertEqual(emb[0, 0], len(query))
+
+    def test_batch_size_is_capped(self):
+        with mock.patch.object(self.search, "EMBED_MAX_BATCH", 2):
+            results, _ = self._encode_concurrently(self.search._EmbedBatcher(), ["a", "bb", "ccc"])
+        self.assertEqual(sorted(len(call) for call in self.calls), [1, 2])
+        self.assertEqual(len(results), 3)
+
+    def test_errors_reach_every_caller(self):
+        self.search.get_model.side_effect = RuntimeError("no model")
+        results, errors = self._encode_concurrently(self.search._EmbedBatcher(), ["a", "bb"])
+        self.assertEqual(results, {})
+        self.assertEqual(set(errors), {"a", "bb"})
+
+
+def _reference_best(per_dir, distance_threshold, k):
+    """Best chunk per path over every directory's chunks, sorted by (distance, position)."""
+    chunks = [
+        (distance, pos, meta["path"])
+        for pos, (meta, distance) in enumerate(
+            (meta, distance) for metas, distances in per_dir for meta, distance in zip(metas, distances)
+        )
+        if distance_threshold is None or distance <= distance_threshold
+    ]
+    seen, best = set(), []
+    for distance, _, path in sorted(chunks):
+        if path not in seen:
+            seen.add(path)
+            best.append({"path": path, "distance": distance})
+    return best[:k]
+
+
+class MultiDirectoryMergeTests(SimpleTestCase):
+    """search_files' k-way merge of per-directory results, with and without a distance threshold."""
+
+    def _search(self, per_dir, k, distance_threshold, merge=None):
+        from semantic_index import search
+
+        directories = [f"dir{i}" for i in range(len(per_dir))]
+        results = dict(zip(directories, per_dir))
+
+        def query_one(dir_name, q_emb, n_results):
+            metas, distances = results[dir_name]
+            ids = [f"{dir_name}-{i}" for i in range(len(metas))]
+            return metas, distances, ids, f"files_{dir_name}" if metas else None
+
+        merge = merge or mock.Mock(wraps=search._merge_best_chunk_indices)
+        with mock.patch.object(search, "get_cached_embedding", return_value=None), \
+                mock.patch.object(search, "_query_one", side_effect=query_one), \
+                mock.patch.object(search, "_merge_best_chunk_indices", merge), \
+                mock.patch.object(search, "UNIFIED_COLLECTION", False):
+            return search.search_files(
+                "query", k=k, directory=directories, include_distances=True,
+                use_reranker=False, distance_threshold=distance_threshold,
+            )
+
+    def test_merge_matches_reference(self):
+        rng = random.Random(1)
+        for _ in range(300):
+            per_dir = []
+            for _ in range(rng.randint(2, 4)):
+                # Each directory's results come back sorted by distance, like a Chroma query
+                distances = sorted(rng.choice([0.1, 0.2, 0.3, rng.random()]) for _ in range(rng.randint(0, 12)))
+                metas = [{"path": f"p{rng.randint(0, 6)}"} for _ in distances]
+                per_dir.append((metas, distances))
+            k = rng.randint(1, 8)
+            distance_threshold = rng.choice([None, 0.15, 0.25, 0.5])
+            with self.subTest(per_dir=per_dir, k=k, distance_threshold=distance_threshold):
+                self.assertEqual(
+                    self._search(per_dir, k, distance_threshold),
+                    _reference_best(per_dir, distance_threshold, k),
+                )
+
+    def test_threshold_remaps_directory_starts(self):
+        from semantic_index import search
+
+        # dir0's chunks are all filtered out and dir1 loses its last one
+        per_dir = [
+            ([{"path": "a"}, {"path": "b"}], [0.8, 0.9]),
+            ([{"path": "c"}, {"path": "a"}, {"path": "d"}], [0.1, 0.2, 0.7]),
+            ([{"path": "e"}, {"path": "a"}], [0.05, 0.3]),
+        ]
+        merge = mock.Mock(wraps=search._merge_best_chunk_indices)
+        self.assertEqual(
+            self._search(per_dir, 5, 0.5, merge=merge),
+            [
+                {"path": "e", "distance": 0.05},
+                {"path": "c", "distance": 0.1},
+                {"path": "a", "distance": 0.2},
+            ],
+        )
+        # Starts of each directory's chunks in the filtered lists: [c, a] + [e, a]
+        _, distances, starts = merge.call_args.args
+        self.assertEqual(starts, [0, 0, 2])
+        self.assertEqual(distances, [0.1, 0.2, 0.05, 0.3])
+
+
+class SearchETagTests(SimpleTestCase):
+    """Conditional GET on /api/search: 304 until a searched directory is reindexed."""
+
+    URL = "/api/search?q=matrix&dir=documents1&include_scores=true&use_reranker=false"
+
+    def setUp(self):
+        self.versions = "documents1=1"
+        self.search = mock.patch.object(
+            views_search, "_cached_search", return_value=[{"path": "documents1/a.pdf", "distance": 0.1}]
+        ).start()
+        mock.patch.object(views_search, "_index_versions", side_effect=lambda _dirs: self.versions).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def test_not_modified(self):
+        response = self.client.get(self.URL)
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+        self.assertEqual(response["Cache-Control"], views_search.SEARCH_CACHE_CONTROL)
+
+        response = self.client.get(self.URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+        # The 304 is answered without searching
+        self.assertEqual(self.search.call_count, 1)
+
+    def test_reindex_changes_etag(self):
+        etag = self.client.get(self.URL)["ETag"]
+        self.versions = "documents1=2"
+        response = self.client.get(self.URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        # The new version is part of the result cache key too
+        self.assertEqual(self.search.call_args.args[-1], "documents1=2")
+
+    def test_parameters_change_etag(self):
+        etag = self.client.get(self.URL)["ETag"]
+        response = self.client.get(self.URL + "&k=7", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+
+class IndexDirectoryTests(SimpleTestCase):
+    """Indexing only ever reads files that really lie under the project root."""
+
+    def setUp(self):
+        from semantic_index import indexer
+
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.base = Path(tmp.name).resolve() / "project"
+        self.outside = Path(tmp.name).resolve() / "outside"
+        (self.base / "documents1").mkdir(parents=True)
+        self.outside.mkdir()
+        (self.base / "documents1" / "a.txt").write_text("a")
+        (self.outside / "b.txt").write_text("b")
+        patcher = mock.patch.object(indexer, "_BASE_RESOLVED", self.base)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.indexer = indexer
+
+    def _symlink(self, target, link):
+        try:
+            os.symlink(target, link)
+        except (OSError, NotImplementedError):
+            self.skipTest("symlinks not supported")
+
+    def test_resolve_documents_dir(self):
+        resolve = self.indexer._resolve_documents_dir
+        self.assertEqual(resolve("documents1"), self.base / "documents1")
+        self.assertEqual(resolve("documents1/../documents1"), self.base / "documents1")
+        for directory in ["..", "../outside", "documents1/../../outside", str(self.outside)]:
+            with self.subTest(directory=directory):
+                with self.assertRaises(ValueError):
+                    resolve(directory)
+
+    def test_symlinked_directory_outside_is_rejected(self):
+        self._symlink(self.outside, self.base / "linked")
+        with self.assertRaises(ValueError):
+            self.indexer._resolve_documents_dir("linked")
+
+    def test_index_documents_rejects_traversal_before_indexing(self):
+        with mock.patch.object(self.indexer, "_list_files") as list_files:
+            with self.assertRaises(ValueError):
+                self.indexer.index_documents(directory="../outside")
+        list_files.assert_not_called()
+
+    def test_symlinked_file_outside_is_skipped(self):
+        documents_dir = self.base / "documents1"
+        self._symlink(self.outside / "b.txt", documents_dir / "b.txt")
+        self._symlink(documents_dir / "a.txt", documents_dir / "c.txt")
+        files = self.indexer._list_files(documents_dir)
+        self.assertEqual(files, [documents_dir / "a.txt", documents_dir / "c.txt"])
+        self.assertEqual(
+            [self.indexer._relative_path(f, documents_dir) for f in files],
+            ["documents1/a.txt", "documents1/c.txt"],
+        )
+
+
+class ClientResetTests(SimpleTestCase):
+    """Invalidating the search handles releases the old ChromaDB system."""
+
+    def test_reset_stops_old_system(self):
+        from semantic_index import search
+
+        client = mock.MagicMock()
+        with mock.patch.object(search, "_CLIENT", client), \
+                mock.patch.object(search, "QUERY_SERVER_SOCKET", None):
+            search.invalidate_collection()
+            self.assertIsNone(search._CLIENT)
+        client._system.stop.assert_called_once_with()
+
+    def test_reset_survives_stop_failure(self):
+        from semantic_index import search
+
+        client = mock.MagicMock()
+        client._system.stop.side_effect = RuntimeError("boom")
+        with mock.patch.object(search, "_CLIENT", client), \
+                mock.patch.object(search, "QUERY_SERVER_SOCKET", None), \
+                mock.patch("builtins.print"):
+            search.invalidate_collection()
+            self.assertIsNone(search._CLIENT)
+
+
+class FakeCollection:
+    """In-memory stand-in for the handful of ChromaDB collection calls the indexer makes."""
+
+    def __init__(self):
+        self.metadata = None
+        self.rows = {}
+
+    def get(self, where=None, include=None, **kwargs):
+        rows = [(i, row) for i, row in self.rows.items() if row["meta"]["chunk"] == where["chunk"]]
+        return {"ids": [i for i, _ in rows], "metadatas": [row["meta"] for _, row in rows]}
+
+    def delete(self, where):
+        paths = set(where["path"]["$in"])
+        self.rows = {i: row for i, row in self.rows.items() if row["meta"]["path"] not in paths}
+
+    def add(self, ids, documents, embeddings, metadatas):
+        for i, doc, meta in zip(ids, documents, metadatas):
+            self.rows[i] = {"doc": doc, "meta": meta}
+
+    def count(self):
+        return len(self.rows)
+
+    def documents(self):
+        return sorted((row["meta"]["path"], row["doc"]) for row in self.rows.values())
+
+
+class IncrementalIndexTests(SimpleTestCase):
+    """Reindexing only re-embeds changed files and keeps the text cache in step."""
+
+    def setUp(self):
+        from concurrent.futures import ThreadPoolExecutor
+
+        import numpy as np
+
+        from semantic_index import indexer
+
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        root = Path(tmp.name).resolve()
+        self.docs = root / "documents1"
+        self.docs.mkdir()
+        self.collection = FakeCollection()
+        self.collection.metadata = indexer._collection_metadata()
+        client = mock.MagicMock()
+        client.get_collection.return_value = self.collection
+        self.model = mock.MagicMock()
+        self.model.device.type = "cpu"
+        self.model.encode.side_effect = lambda docs, **kwargs: np.zeros((len(docs), 4), dtype=np.float32)
+        self.cache_dir = root / ".chroma" / "textcache" / "documents1"
+        for patcher in [
+            mock.patch.object(indexer, "_BASE_RESOLVED", root),
+            mock.patch.object(indexer, "CHROMA_DIR", root / ".chroma"),
+            mock.patch.object(indexer, "TEXT_CACHE_DIR", root / ".chroma" / "textcache"),
+            mock.patch.object(indexer, "VERSION_DIR", root / ".chroma" / "versions"),
+            mock.patch.object(indexer, "UNIFIED_COLLECTION", False),
+            mock.patch.object(indexer, "_get_model", return_value=self.model),
+            mock.patch.object(indexer.chromadb, "PersistentClient", return_value=client),
+            mock.patch.object(
+                indexer, "ProcessPoolExecutor", lambda **kwargs: ThreadPoolExecutor(kwargs["max_workers"])
+            ),
+            mock.patch("semantic_index.search.invalidate_collection"),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.indexer = indexer
+
+    def _index(self):
+        self.indexer.index_documents(directory="documents1")
+
+    def _embedded(self):
+        """Documents passed to the model since the last call."""
+        docs = [doc for call in self.model.encode.call_args_list for doc in call.args[0]]
+        self.model.encode.reset_mock()
+        return docs
+
+    def _cached_keys(self):
+        return sorted(p.stem for p in self.cache_dir.glob("*.json"))
+
+    def _keys(self):
+        return sorted(self.indexer._file_key(p) for p in self.docs.iterdir())
+
+    def test_add_modify_delete(self):
+        (self.docs / "a.txt").write_text("alpha")
+        (self.docs / "b.txt").write_text("bravo")
+        self._index()
+        self.assertEqual(sorted(self._embedded()), ["alpha", "bravo"])
+        self.assertEqual(self.collection.documents(), [("documents1/a.txt", "alpha"), ("documents1/b.txt", "bravo")])
+        self.assertEqual(self._cached_keys(), self._keys())
+
+        # Unchanged: nothing is re-embedded
+        self._index()
+        self.assertEqual(self._embedded(), [])
+
+        # Added: only the new file is embedded
+        (self.docs / "c.txt").write_text("charlie")
+        self._index()
+        self.assertEqual(self._embedded(), ["charlie"])
+        self.assertEqual(self._cached_keys(), self._keys())
+
+        # Modified: its old chunks and cache entry are replaced
+        (self.docs / "a.txt").write_text("alpha two")
+        self._index()
+        self.assertEqual(self._embedded(), ["alpha two"])
+        self.assertEqual(
+            self.collection.documents(),
+            [("documents1/a.txt", "alpha two"), ("documents1/b.txt", "bravo"), ("documents1/c.txt", "charlie")],
+        )
+        self.assertEqual(self._cached_keys(), self._keys())
+
+        # Deleted: its chunks and cache entry are removed
+        (self.docs / "b.txt").unlink()
+        self._index()
+        self.assertEqual(self._embedded(), [])
+        self.assertEqual(self.collection.documents(), [("documents1/a.txt", "alpha two"), ("documents1/c.txt", "charlie")])
+        self.assertEqual(self._cached_keys(), self._keys())
+
+
+class ReindexPoolTests(SimpleTestCase):
+    """All indexing, synchronous or not, goes through one single-worker pool."""
+
+    def setUp(self):
+        patcher = mock.patch.object(views_reindex, "_index_pool", None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_pool_created_once_under_concurrency(self):
+        barrier = threading.Barrier(8)
+        pools = []
+
+        def get_pool():
+            barrier.wait()
+            pools.append(views_reindex._get_index_pool())
+
+        with mock.patch.object(views_reindex, "ProcessPoolExecutor", side_effect=lambda **kwargs: object()) as pool_cls:
+            threads = [threading.Thread(target=get_pool) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        pool_cls.assert_called_once()
+        self.assertEqual(len({id(pool) for pool in pools}), 1)
+
+    def _reindex(self, result=None, error=None):
+        from concurrent.futures import Future
+
+        future = Future()
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+        pool = mock.MagicMock()
+        pool.submit.return_value = future
+        with mock.patch.object(views_reindex, "_get_index_pool", return_value=pool), \
+                mock.patch.object(views_reindex, "_clear_search_caches") as clear:
+            response = views_reindex.api_reindex(RequestFactory().get("/api/reindex", {"dir": "documents1"}))
+        pool.submit.assert_called_once_with(views_reindex._index_directory, "documents1")
+        clear.assert_called_once_with()
+        return response
+
+    def test_sync_reindex_runs_in_pool(self):
+        response = self._reindex(result=7)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content), {"indexed_chunks": 7, "directory": "documents1"})
+
+    def test_sync_reindex_rejects_outside_directory(self):
+        response = self._reindex(error=ValueError("outside the project"))
+        self.assertEqual(response.status_code, 400)
+
+
+class UnifiedCollectionTests(SimpleTestCase):
+    """Mirroring a directory into the unified collection."""
+
+    def test_name_cannot_collide_with_a_directory(self):
+        from semantic_index.indexer import UNIFIED_COLLECTION_NAME
+
+        self.assertFalse(UNIFIED_COLLECTION_NAME.startswith("files_"))
+
+    def test_copies_in_pages(self):
+        from semantic_index import indexer
+
+        rows = [(f"id{i}", f"doc{i}", [float(i)], {"path": f"documents1/{i}.txt", "chunk": 0}) for i in range(5)]
+
+        def get(include, limit, offset):
+            page = rows[offset:offset + limit]
+            return {
+                "ids": [r[0] for r in page],
+                "documents": [r[1] for r in page],
+                "embeddings": [r[2] for r in page],
+                "metadatas": [r[3] for r in page],
+            }
+
+        source = mock.MagicMock()
+        source.get.side_effect = get
+        unified = mock.MagicMock()
+        with mock.patch.object(indexer, "_open_collection", return_value=unified):
+            indexer._sync_unified_collection(mock.MagicMock(), source, "documents1", True, 2)
+        unified.delete.assert_called_once_with(where={"dir": "documents1"})
+        self.assertEqual([len(call.kwargs["ids"]) for call in unified.add.call_args_list], [2, 2, 1])
+        self.assertTrue(all(call.kwargs["limit"] == 2 for call in source.get.call_args_list))
+        added = [meta for call in unified.add.call_args_list for meta in call.kwargs["metadatas"]]
+        self.assertEqual(added, [dict(r[3], dir="documents1") for r in rows])
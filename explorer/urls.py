@@ -1,11 +1,13 @@
 from django.urls import path
-from .views import api_search, api_reindex, api_reindex_start, api_reindex_status, api_open
+from .views import api_search, api_reindex, api_reindex_start, api_reindex_status, api_reindex_events, api_open, api_open_stream
 
 urlpatterns = [
     path("search", api_search),
     path("reindex", api_reindex),
     path("reindex/start", api_reindex_start),
     path("reindex/status", api_reindex_status),
+    path("reindex/events", api_reindex_events),
     path("open", api_open),
+    path("open/stream", api_open_stream),
 ]
 
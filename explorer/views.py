@@ -8,11 +8,11 @@ This file acts as a central import point. Views are split into:
 """
 from django.http import HttpResponse
 from .views_search import api_search
-from .views_reindex import api_reindex, api_reindex_start, api_reindex_status
-from .views_open import api_open
+from .views_reindex import api_reindex, api_reindex_start, api_reindex_status, api_reindex_events
+from .views_open import api_open, api_open_stream
 
 # Export all views for use in urls.py
-__all__ = ['home', 'api_search', 'api_reindex', 'api_reindex_start', 'api_reindex_status', 'api_open']
+__all__ = ['home', 'api_search', 'api_reindex', 'api_reindex_start', 'api_reindex_status', 'api_reindex_events', 'api_open', 'api_open_stream']
 
 
 def home(request):
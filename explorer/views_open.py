@@ -1,18 +1,68 @@
 """
 File opening API views - handles opening files via OS or returning preview content.
 """
-from django.http import JsonResponse, HttpResponse, FileResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
 from django.views.decorators.http import require_GET
 from pathlib import Path
+import asyncio
 import subprocess
 import sys
 import os
-import fitz  # PyMuPDF
+import threading
+import time
+from collections import OrderedDict
 
 # Configuration - allowed document directories
 BASE_DIR = Path(__file__).resolve().parents[1]
 ALLOWED_DIRECTORIES = ["documents1", "documents2"]
 MAX_PREVIEW_SIZE = 5 * 1024 * 1024  # 5MB max for preview
+PREVIEW_PAGES = 10  # Only the first N pages of a PDF are extracted for preview
+PDF_CACHE_MAXSIZE = 8  # Open PDF documents kept around for repeat previews
+PDF_CACHE_TTL = 60  # seconds
+STREAM_BLOCK_SIZE = 64 * 1024  # Bytes per chunk when streaming a text file preview
+
+# PyMuPDF is imported on first use (see _get_fitz) so workers that never serve a
+# PDF preview don't pay for loading it
+_fitz = None
+
+# Allowed directories as relative roots and "documents1/" prefixes, for a single
+# C-level str.startswith(tuple) check instead of a Python loop
+_ALLOWED_ROOTS = frozenset(ALLOWED_DIRECTORIES)
+_ALLOWED_PREFIXES = tuple(d + "/" for d in ALLOWED_DIRECTORIES)
+
+# Resolved once at import instead of on every request
+_BASE_RESOLVED = BASE_DIR.resolve()
+# Resolved allowed directories as "/abs/path/documents1/" prefixes
+_ALLOWED_RESOLVED_PREFIXES = tuple((_BASE_RESOLVED / d).as_posix() + "/" for d in ALLOWED_DIRECTORIES)
+
+# MuPDF's global context isn't thread-safe, so every PyMuPDF call in this process
+# (open, page access, text extraction, close) runs under this one lock, whichever
+# document it is for. It also guards _pdf_cache.
+_fitz_lock = threading.Lock()
+
+# Recently opened PDFs, so repeat previews of the same file skip open + parse.
+# Key: "path:mtime_ns" (a modified file gets a new entry), Value: (document, opened_at).
+_pdf_cache: "OrderedDict[str, tuple[object, float]]" = OrderedDict()
+
+
+def _get_fitz():
+    """Import PyMuPDF on first use and cache the module."""
+    global _fitz
+    if _fitz is None:
+        import fitz  # PyMuPDF
+        _fitz = fitz
+    return _fitz
+
+
+def _page_text(pdf, page_num: int) -> str:
+    """
+    Extract plain text from one page of an open PDF.
+    
+    Skips ligature and whitespace preservation (PyMuPDF's TEXTFLAGS_TEXT default),
+    only keeping clipping to the page's mediabox.
+    """
+    return pdf[page_num].get_text("text", flags=_get_fitz().TEXT_MEDIABOX_CLIP)
 
 
 def _is_safe_path(file_path: str) -> tuple[bool, Path | None]:
@@ -29,55 +79,169 @@ def _is_safe_path(file_path: str) -> tuple[bool, Path | None]:
     normalized = Path(file_path).as_posix()  # Use forward slashes
     
     # Check if path starts with any allowed directory
-    for allowed_dir in ALLOWED_DIRECTORIES:
-        if normalized.startswith(allowed_dir + "/") or normalized == allowed_dir:
-            full_path = BASE_DIR / normalized
-            # Ensure the resolved path is still within BASE_DIR (prevent directory traversal)
-            try:
-                resolved = full_path.resolve()
-                if BASE_DIR.resolve() in resolved.parents or resolved == BASE_DIR.resolve():
-                    return True, resolved
-            except (OSError, ValueError):
-                pass
+    if not (normalized in _ALLOWED_ROOTS or normalized.startswith(_ALLOWED_PREFIXES)):
+        return False, None
+    
+    # Ensure the resolved path is still within an allowed directory (prevent directory traversal)
+    try:
+        resolved = (BASE_DIR / normalized).resolve(strict=False)
+    except (OSError, ValueError):
+        return False, None
+    candidate = resolved.as_posix()
+    if candidate.startswith(_ALLOWED_RESOLVED_PREFIXES) or candidate + "/" in _ALLOWED_RESOLVED_PREFIXES:
+        return True, resolved
     
     return False, None
 
 
-def _read_text_file_preview(path: Path) -> dict:
-    """Read text file and return preview content."""
+def _read_text_file_preview(path: Path, file_size: int) -> dict:
+    """
+    Read text file and return preview content.
+    
+    file_size is the byte size already obtained from stat() by the caller,
+    so the content doesn't need to be re-encoded just to measure it.
+    """
     try:
-        with path.open("r", encoding="utf-8", errors="ignore") as f:
-            content = f.read()
+        # Read raw bytes and decode once: skips text-mode newline translation
+        with path.open("rb") as f:
+            content = f.read().decode("utf-8", "ignore")
         return {
             "type": "text",
             "content": content,
-            "size": len(content.encode("utf-8")),
+            "size": file_size,
         }
     except Exception as e:
         return {"error": f"Failed to read file: {str(e)}"}
 
 
+def _get_cached_pdf(path: Path):
+    """
+    Return the open document for a PDF, opening and caching it on a miss.
+    
+    Must be called with _fitz_lock held, and the document only used while it is
+    still held. That is also what makes it safe to close expired and evicted
+    documents here: nobody else can be reading them.
+    """
+    key = f"{path}:{path.stat().st_mtime_ns}"
+    now = time.monotonic()
+    
+    entry = _pdf_cache.get(key)
+    if entry is not None:
+        pdf, opened_at = entry
+        if now - opened_at < PDF_CACHE_TTL:
+            _pdf_cache.move_to_end(key)
+            return pdf
+        del _pdf_cache[key]
+        pdf.close()
+    
+    pdf = _get_fitz().open(str(path))
+    _pdf_cache[key] = (pdf, now)
+    while len(_pdf_cache) > PDF_CACHE_MAXSIZE:
+        _, (old_pdf, _) = _pdf_cache.popitem(last=False)  # Evict least recently used
+        old_pdf.close()
+    return pdf
+
+
 def _read_pdf_preview(path: Path) -> dict:
-    """Extract text from PDF and return preview content."""
+    """
+    Extract text from PDF and return preview content.
+    
+    At most PREVIEW_PAGES pages are extracted, in this thread from one (cached)
+    parse of the document; that's cheaper than shipping pages to worker processes
+    that would each have to re-open and re-parse the file. Extraction holds
+    _fitz_lock, so concurrent PDF previews run one at a time.
+    """
     try:
-        text = ""
-        with fitz.open(str(path)) as pdf:
+        with _fitz_lock:
+            pdf = _get_cached_pdf(path)
             total_pages = len(pdf)
-            # Limit to first 10 pages for preview
-            for page_num in range(min(10, total_pages)):
-                text += pdf[page_num].get_text()
+            # Limit to first PREVIEW_PAGES pages for preview
+            preview_pages = min(PREVIEW_PAGES, total_pages)
+            parts = [_page_text(pdf, page_num) for page_num in range(preview_pages)]
+        
+        # Join once at the end instead of += per page (avoids quadratic copying)
+        text = "".join(parts)
         return {
             "type": "pdf",
             "content": text,
             "pages": total_pages,
-            "preview_pages": min(10, total_pages),
+            "preview_pages": preview_pages,
         }
     except Exception as e:
         return {"error": f"Failed to read PDF: {str(e)}"}
 
 
+def _read_pdf_page(path: Path, page_num: int) -> str | None:
+    """
+    Extract one page of a PDF's preview from the cached document.
+    
+    Returns None once page_num is past the first PREVIEW_PAGES pages (or the end
+    of the document). Each call takes _fitz_lock only for its own page, so other
+    previews can run between the pages of a stream.
+    """
+    with _fitz_lock:
+        pdf = _get_cached_pdf(path)
+        if page_num >= min(PREVIEW_PAGES, len(pdf)):
+            return None
+        return _page_text(pdf, page_num)
+
+
+def _iter_pdf_preview(path: Path):
+    """Yield the text of the first PREVIEW_PAGES pages of a PDF, one page at a time."""
+    for page_num in range(PREVIEW_PAGES):
+        text = _read_pdf_page(path, page_num)
+        if text is None:
+            return
+        yield text
+
+
+async def _aiter_pdf_preview(path: Path):
+    """Async _iter_pdf_preview for ASGI; extraction runs in a worker thread."""
+    for page_num in range(PREVIEW_PAGES):
+        text = await asyncio.to_thread(_read_pdf_page, path, page_num)
+        if text is None:
+            return
+        yield text
+
+
+def _iter_file_blocks(path: Path):
+    """Yield a file's bytes in STREAM_BLOCK_SIZE blocks."""
+    with path.open("rb") as f:
+        while True:
+            block = f.read(STREAM_BLOCK_SIZE)
+            if not block:
+                return
+            yield block
+
+
+async def _aiter_file_blocks(path: Path):
+    """Async _iter_file_blocks for ASGI; reads run in a worker thread."""
+    f = await asyncio.to_thread(path.open, "rb")
+    try:
+        while True:
+            block = await asyncio.to_thread(f.read, STREAM_BLOCK_SIZE)
+            if not block:
+                return
+            yield block
+    finally:
+        f.close()
+
+
+def _open_with_os(full_path: Path):
+    """Open a file with the OS default application (cross-platform)."""
+    if sys.platform == "win32":
+        # Windows
+        os.startfile(str(full_path))
+    elif sys.platform == "darwin":
+        # macOS
+        subprocess.run(["open", str(full_path)], check=True)
+    else:
+        # Linux and other Unix-like systems
+        subprocess.run(["xdg-open", str(full_path)], check=True)
+
+
 @require_GET
-def api_open(request):
+async def api_open(request):
     """
     Open a file via OS default application or return preview content.
     
@@ -86,6 +250,9 @@ def api_open(request):
     - mode (optional): "preview" to return content, "open_os" to open with OS app (default: "preview")
     
     Returns JSON with file content/metadata for preview mode, or success/error for open_os mode.
+    
+    Async view: file reading, PDF extraction and the OS open call run in a worker
+    thread so they don't block the event loop.
     """
     file_path = request.GET.get("path", "").strip()
     mode = request.GET.get("mode", "preview").strip().lower()
@@ -115,9 +282,9 @@ def api_open(request):
         # Determine file type and read accordingly
         suffix = full_path.suffix.lower()
         if suffix == ".txt":
-            result = _read_text_file_preview(full_path)
+            result = await asyncio.to_thread(_read_text_file_preview, full_path, file_size)
         elif suffix == ".pdf":
-            result = _read_pdf_preview(full_path)
+            result = await asyncio.to_thread(_read_pdf_preview, full_path)
         else:
             return JsonResponse({"error": f"Unsupported file type: {suffix}"}, status=400)
         
@@ -126,21 +293,14 @@ def api_open(request):
         
         result["path"] = file_path
         result["name"] = full_path.name
-        return JsonResponse(result)
+        # ensure_ascii=False keeps non-ASCII text as UTF-8 instead of \uXXXX escapes
+        return JsonResponse(result, json_dumps_params={"ensure_ascii": False})
     
     # Handle open_os mode
     elif mode == "open_os":
         try:
             # Cross-platform file opening
-            if sys.platform == "win32":
-                # Windows
-                os.startfile(str(full_path))
-            elif sys.platform == "darwin":
-                # macOS
-                subprocess.run(["open", str(full_path)], check=True)
-            else:
-                # Linux and other Unix-like systems
-                subprocess.run(["xdg-open", str(full_path)], check=True)
+            await asyncio.to_thread(_open_with_os, full_path)
             
             return JsonResponse({
                 "success": True,
@@ -161,3 +321,50 @@ def api_open(request):
     else:
         return JsonResponse({"error": f"Invalid mode: {mode}. Use 'preview' or 'open_os'"}, status=400)
 
+
+@require_GET
+async def api_open_stream(request):
+    """
+    Stream preview content as plain text instead of a single JSON document.
+    
+    Query parameters:
+    - path (required): Relative file path from project root (e.g., "documents1/file.pdf")
+    
+    Text files are streamed straight from disk; PDFs are streamed page by page
+    (first PREVIEW_PAGES pages), so the client gets the first page as soon as it
+    is extracted and the server never holds the whole preview in memory.
+    
+    Each server type only streams one kind of iterator without buffering it: ASGI
+    collects a sync iterator in full on Django's sync thread, and WSGI (e.g.
+    runserver) drains an async one before sending anything. So ASGI gets async
+    iterators (disk reads and extraction in a worker thread) and WSGI sync ones.
+    """
+    file_path = request.GET.get("path", "").strip()
+    if not file_path:
+        return JsonResponse({"error": "missing 'path' parameter"}, status=400)
+    
+    # Validate path is safe
+    is_safe, full_path = _is_safe_path(file_path)
+    if not is_safe or full_path is None:
+        return JsonResponse({"error": "Invalid or unauthorized file path"}, status=403)
+    
+    # Check if file exists
+    if not full_path.exists() or not full_path.is_file():
+        return JsonResponse({"error": "File not found"}, status=404)
+    
+    file_size = full_path.stat().st_size
+    if file_size > MAX_PREVIEW_SIZE:
+        return JsonResponse({
+            "error": f"File too large for preview (max {MAX_PREVIEW_SIZE / 1024 / 1024:.1f}MB)",
+            "size": file_size,
+        }, status=413)
+    
+    suffix = full_path.suffix.lower()
+    asgi = isinstance(request, ASGIRequest)
+    if suffix == ".txt":
+        stream = _aiter_file_blocks(full_path) if asgi else _iter_file_blocks(full_path)
+        return StreamingHttpResponse(stream, content_type="text/plain; charset=utf-8")
+    if suffix == ".pdf":
+        stream = _aiter_pdf_preview(full_path) if asgi else _iter_pdf_preview(full_path)
+        return StreamingHttpResponse(stream, content_type="text/plain; charset=utf-8")
+    return JsonResponse({"error": f"Unsupported file type: {suffix}"}, status=400)
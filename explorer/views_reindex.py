@@ -1,12 +1,47 @@
 """
 Reindexing API views - handles rebuilding the semantic search index with progress tracking.
 """
-from django.http import JsonResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
 from django.views.decorators.http import require_GET, require_http_methods
 from django.views.decorators.csrf import csrf_exempt
-from semantic_index.indexer import index_documents
 from semantic_index.progress import start_job, update_job, finish_job, fail_job, get_job
+from .views_search import clear_search_cache
+from concurrent.futures import ProcessPoolExecutor
+import asyncio
+import json
+import multiprocessing
 import threading
+import time
+
+# How often the event stream checks the progress store for changes (seconds)
+EVENTS_POLL_INTERVAL = 0.5
+
+# Process pool for background indexing jobs (created on first use, shared across requests).
+# Text extraction and embedding are CPU-bound, so running them in a separate process
+# keeps the GIL free for request handling while a reindex is in progress.
+# - spawn, not fork: the web process may already hold the embedding model (on CUDA,
+#   which can't be re-initialized in a forked child) and tokenizer thread pools
+# - one worker: jobs run one at a time, so at most one extra process writes to
+#   CHROMA_DIR (ChromaDB's persistent client isn't safe to share across processes)
+_index_pool: ProcessPoolExecutor | None = None
+_index_pool_lock = threading.Lock()  # Concurrent first requests must not each create a pool
+
+
+def _get_index_pool() -> ProcessPoolExecutor:
+    """Create the shared indexing pool on first use."""
+    global _index_pool
+    with _index_pool_lock:
+        if _index_pool is None:
+            _index_pool = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+        return _index_pool
+
+
+def _index_directory(directory: str) -> int:
+    """Run index_documents in the indexing worker process (used by the synchronous endpoint)."""
+    # Imported lazily: only the indexing worker process needs the heavy dependencies
+    from semantic_index.indexer import index_documents
+    return index_documents(directory=directory)
 
 
 @require_GET
@@ -23,27 +58,40 @@ def api_reindex(request):
     Returns JSON with the number of chunks indexed.
     
     Note: This is the legacy synchronous endpoint. For progress tracking, use
-    /api/reindex/start instead.
+    /api/reindex/start instead. It still runs in the shared indexing pool and waits
+    for the result, so it never writes CHROMA_DIR concurrently with a background job.
     """
     directory = request.GET.get("dir", "documents1").strip()
     if not directory:
         return JsonResponse({"error": "directory name cannot be empty"}, status=400)
     
-    count = index_documents(directory=directory)
+    try:
+        count = _get_index_pool().submit(_index_directory, directory).result()
+    except ValueError as e:
+        # Directory resolves outside the project root
+        return JsonResponse({"error": str(e)}, status=400)
+    finally:
+        # The worker process invalidated its own handles; drop this process's too
+        _clear_search_caches()
     return JsonResponse({"indexed_chunks": count, "directory": directory})
 
 def _run_indexing(job_id: str, directory: str, slow_ms: int):
     """
     Background function to run indexing with progress tracking.
     
-    This runs in a separate thread so the HTTP request can return immediately
-    with a job_id, while indexing continues in the background.
+    This runs in a worker process from _get_index_pool() so the HTTP request can
+    return immediately with a job_id, while indexing continues in the background.
+    Progress is written to the shared SQLite progress store, which the web
+    process reads from in api_reindex_status.
     
     Args:
         job_id: Job identifier for progress tracking (UUID string)
         directory: Directory to index (e.g., "documents1")
         slow_ms: Artificial delay in milliseconds per file (for testing progress bar)
     """
+    # Imported lazily: only the indexing worker process needs the heavy dependencies
+    from semantic_index.indexer import index_documents
+    
     # Use list [0] instead of int because Python's nested functions can't modify
     # outer scope variables directly, but they CAN modify list contents
     total_files = [0]  # Will store total number of files found
@@ -71,6 +119,13 @@ def _run_indexing(job_id: str, directory: str, slow_ms: int):
         fail_job(job_id, str(e))
 
 
+def _clear_search_caches():
+    """Invalidate cached search results and the cached ChromaDB handles after a reindex."""
+    from semantic_index.search import invalidate_collection
+    invalidate_collection()
+    clear_search_cache()
+
+
 @csrf_exempt
 @require_http_methods(["POST"])
 def api_reindex_start(request):
@@ -99,17 +154,23 @@ def api_reindex_start(request):
     # total=0 initially because we don't know how many files yet
     job_id = start_job(directory, total=0)
     
-    # BACKGROUND THREADING: Start indexing in a separate thread
+    # BACKGROUND PROCESSING: Submit indexing to the process pool
     # This allows the HTTP request to return immediately with job_id,
-    # while indexing continues in the background
-    thread = threading.Thread(target=_run_indexing, args=(job_id, directory, slow_ms))
-    thread.daemon = True  # Thread dies when main program exits
-    thread.start()  # Start the thread (calls _run_indexing)
+    # while indexing continues in a worker process
+    future = _get_index_pool().submit(_run_indexing, job_id, directory, slow_ms)
+    # Searches in every process notice the reindex through the directory's index
+    # version; this just drops this process's stale handles and results right away
+    future.add_done_callback(lambda _future: _clear_search_caches())
     
     # Return immediately - don't wait for indexing to finish
     return JsonResponse({"job_id": job_id})
 
 
+def _progress_etag(progress: dict) -> str:
+    """Weak ETag that changes whenever the job's progress changes."""
+    return f'W/"{progress.get("updated_at")}-{progress.get("current")}-{progress.get("phase")}-{progress.get("status")}"'
+
+
 @require_GET
 def api_reindex_status(request):
     """
@@ -133,6 +194,9 @@ def api_reindex_status(request):
     }
     
     Returns 404 if job_id not found.
+    
+    Responses carry an ETag; if the client sends it back in If-None-Match and
+    nothing changed since, we return an empty 304 instead of re-serializing.
     """
     job_id = request.GET.get("job_id", "").strip()
     if not job_id:
@@ -142,4 +206,86 @@ def api_reindex_status(request):
     if progress is None:
         return JsonResponse({"error": "Job not found"}, status=404)
     
-    return JsonResponse(progress)
\ No newline at end of file
+    etag = _progress_etag(progress)
+    if request.META.get("HTTP_IF_NONE_MATCH") == etag:
+        response = HttpResponse(status=304)
+    else:
+        response = JsonResponse(progress)
+    response["ETag"] = etag
+    # no-cache = "revalidate every time", so browsers send If-None-Match on each poll
+    response["Cache-Control"] = "no-cache"
+    return response
+
+
+@require_GET
+async def api_reindex_events(request):
+    """
+    Stream progress of an indexing job as Server-Sent Events.
+    
+    Query parameters:
+    - job_id (required): Job identifier returned from /api/reindex/start
+    
+    Alternative to polling /api/reindex/status: one long-lived connection that
+    pushes a "data: {...}" event (same JSON as the status endpoint) each time the
+    progress changes, and closes once the job is completed or failed.
+    
+    Each server type only streams one kind of iterator without buffering it: ASGI
+    consumes a sync generator in one go on Django's sync thread, and WSGI (e.g.
+    runserver) drains an async one before sending anything. So ASGI gets an async
+    event stream (progress store reads in a worker thread) and WSGI a sync one.
+    The frontend polls /api/reindex/status by default, which works under both.
+    
+    Returns 404 if job_id not found.
+    """
+    job_id = request.GET.get("job_id", "").strip()
+    if not job_id:
+        return JsonResponse({"error": "missing 'job_id' parameter"}, status=400)
+    
+    if await asyncio.to_thread(get_job, job_id) is None:
+        return JsonResponse({"error": "Job not found"}, status=404)
+    
+    if isinstance(request, ASGIRequest):
+        stream = _aiter_progress_events(job_id)
+    else:
+        stream = _iter_progress_events(job_id)
+    response = StreamingHttpResponse(stream, content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    return response
+
+
+def _progress_event(progress: dict, last_etag: str | None) -> tuple[str | None, str]:
+    """Return (SSE event, or None if progress is unchanged since last_etag; new etag)."""
+    etag = _progress_etag(progress)
+    if etag == last_etag:
+        return None, etag
+    return f"data: {json.dumps(progress)}\n\n", etag
+
+
+def _iter_progress_events(job_id: str):
+    """Sync event stream for WSGI servers; see api_reindex_events."""
+    last_etag = None
+    while True:
+        progress = get_job(job_id)
+        if progress is None:
+            return
+        event, last_etag = _progress_event(progress, last_etag)
+        if event:
+            yield event
+        if progress.get("status") in ("completed", "error"):
+            return
+        time.sleep(EVENTS_POLL_INTERVAL)
+
+
+async def _aiter_progress_events(job_id: str):
+    """Async event stream for ASGI servers; see api_reindex_events."""
+    last_etag = None
+    while True:
+        progress = await asyncio.to_thread(get_job, job_id)
+        if progress is None:
+            return
+        event, last_etag = _progress_event(progress, last_etag)
+        if event:
+            yield event
+        if progress.get("status") in ("completed", "error"):
+            return
+        await asyncio.sleep(EVENTS_POLL_INTERVAL)
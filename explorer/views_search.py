@@ -1,31 +1,223 @@
 """
 Search API views - handles semantic file search with pagination and distance filtering.
 """
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse
 from django.views.decorators.http import require_GET
-from semantic_index.search import search_files
+from collections import OrderedDict
+import asyncio
+import base64
+import copy
+import hashlib
+import threading
+import time
+
+# Search result cache: repeated queries (e.g. paging back and forth through the
+# same search) are served from memory instead of re-embedding and re-querying.
+# Key: SHA-256 of the search arguments and the searched directories' index
+# versions (so a reindex by any process misses), Value: (timestamp, results)
+SEARCH_CACHE_MAXSIZE = 512
+SEARCH_CACHE_TTL = 300  # seconds
+
+# Browser caching of search responses. Responses carry an ETag that includes each
+# searched directory's index version, so a reindex changes it. no-cache makes the
+# browser revalidate every time (cheap 304s) instead of reusing results from
+# before a reindex.
+SEARCH_CACHE_CONTROL = "private, no-cache"
+
+# In pagination mode we retrieve this many results once and serve every page by
+# slicing the cached list, instead of re-retrieving all prior pages per request.
+PAGINATION_TOP_K = 200
+
+# Integer query parameters longer than this are treated as malformed
+MAX_INT_PARAM_DIGITS = 9
+
+_search_cache: "OrderedDict[str, tuple[float, list]]" = OrderedDict()
+_search_cache_lock = threading.Lock()
+
+
+def _cached_search(
+    q: str,
+    directories: list,
+    k: int,
+    include_distances: bool,
+    use_reranker: bool,
+    distance_threshold: float | None = None,
+    versions: str = "",
+) -> list:
+    """
+    Call search_files, reusing a recent result for identical arguments.
+    
+    versions is the searched directories' index versions (from _index_versions);
+    it is part of the cache key, so results from before a reindex are never reused.
+    Entries expire after SEARCH_CACHE_TTL seconds; the least recently used entry
+    is evicted once SEARCH_CACHE_MAXSIZE is reached. Returns a copy so callers
+    can't mutate the cached list.
+    """
+    key = hashlib.sha256(
+        f"{q}|{','.join(sorted(directories))}|{k}|{include_distances}|{use_reranker}|{distance_threshold}|{versions}".encode("utf-8")
+    ).hexdigest()
+    now = time.monotonic()
+    
+    with _search_cache_lock:
+        entry = _search_cache.get(key)
+        if entry is not None:
+            ts, results = entry
+            if now - ts < SEARCH_CACHE_TTL:
+                _search_cache.move_to_end(key)
+                return copy.deepcopy(results)
+            del _search_cache[key]  # Expired
+    
+    # Imported here rather than at module load: semantic_index.search pulls in
+    # chromadb and sentence-transformers, which are only needed once a search runs
+    from semantic_index.search import search_files
+    
+    results = search_files(
+        q,
+        k=k,
+        directory=directories,
+        include_distances=include_distances,
+        use_reranker=use_reranker,
+        distance_threshold=distance_threshold,
+    )
+    
+    with _search_cache_lock:
+        _search_cache[key] = (now, copy.deepcopy(results))
+        _search_cache.move_to_end(key)
+        while len(_search_cache) > SEARCH_CACHE_MAXSIZE:
+            _search_cache.popitem(last=False)  # Evict least recently used
+    
+    return results
+
+
+def clear_search_cache():
+    """
+    Drop all cached search results in this process. Not needed for correctness
+    (entries are keyed by index version); it just frees entries a reindex made stale.
+    """
+    with _search_cache_lock:
+        _search_cache.clear()
+
+
+def _index_versions(directories: list) -> str:
+    """The searched directories' index versions, e.g. "documents1=123,documents2=0"."""
+    from semantic_index.search import get_collection_version
+    
+    return ",".join(f"{d}={get_collection_version(d)}" for d in sorted(directories))
+
+
+def _search_etag(versions: str, *params) -> str:
+    """
+    ETag for a search response: a hash of every parameter that shapes the response
+    plus the index version of each searched directory (from _index_versions).
+    """
+    raw = "|".join(str(p) for p in params) + "|" + versions
+    return f'W/"{hashlib.sha256(raw.encode("utf-8")).hexdigest()}"'
+
+
+def _get_int(request, key: str, default: int, lo: int, hi: int | None = None) -> int:
+    """
+    Parse an integer query parameter, clamped to [lo, hi].
+    
+    Missing or malformed values (including negatives) fall back to default.
+    Checks the string instead of try/except so well-formed input never raises;
+    isascii() is needed because isdecimal() also accepts non-ASCII digits, and the
+    length cap keeps int() clear of its 4300-digit limit (and of huge ints).
+    """
+    value = request.GET.get(key)
+    if value is None:
+        return default
+    value = value.strip()
+    if len(value) > MAX_INT_PARAM_DIGITS or not (value.isascii() and value.isdecimal()):
+        return default
+    parsed = max(lo, int(value))
+    return parsed if hi is None else min(hi, parsed)
+
+
+def _get_float(request, key: str, default: float | None = None, lo: float = 0.0) -> float | None:
+    """Parse a float query parameter (at least lo). Missing or malformed values return default."""
+    value = request.GET.get(key)
+    if not value:
+        return default
+    try:
+        return max(lo, float(value))
+    except ValueError:
+        return default
+
+
+def _compute_confidence(result_items) -> tuple[float, str]:
+    """
+    Compute an overall confidence score/label from reranker scores.
+    We look at the maximum rerank_score across all results (if present).
+    """
+    best_score = 0.0
+    if isinstance(result_items, list):
+        best_score = max(
+            (float(r.get("rerank_score") or 0.0) for r in result_items if isinstance(r, dict)),
+            default=0.0,
+        )
+        best_score = max(best_score, 0.0)
+    # Map numeric score to coarse confidence level
+    if best_score >= 0.8:
+        level = "high"
+    elif best_score >= 0.3:
+        level = "medium"
+    else:
+        level = "low"
+    return best_score, level
+
+
+def _project(results: list, include_scores: bool) -> list:
+    """
+    Shape search results for the response: result dicts if include_scores,
+    otherwise just the file paths (backward compatible: ["path1", "path2"]).
+    """
+    if include_scores:
+        return results
+    return [r["path"] if isinstance(r, dict) else r for r in results]
+
+
+def _encode_cursor(offset: int) -> str:
+    """Encode a result offset as an opaque cursor string for the client."""
+    return base64.urlsafe_b64encode(str(offset).encode("ascii")).decode("ascii")
+
+
+def _decode_cursor(cursor: str) -> int | None:
+    """Decode a cursor from _encode_cursor. Returns None if it is malformed."""
+    try:
+        return max(0, int(base64.urlsafe_b64decode(cursor.encode("ascii")).decode("ascii")))
+    except (ValueError, UnicodeError):
+        return None
 
 
 @require_GET
-def api_search(request):
+async def api_search(request):
     """
     Search for files using semantic similarity.
     
+    Async view: the blocking embedding + ChromaDB query runs in a worker thread,
+    so the event loop can serve other requests in the meantime.
+    
     Query parameters:
     - q (required): Search query string
     - k (optional): Number of results to return (default: 5, max: 50) - used when pagination not specified
     - page (optional): Page number for pagination (default: 1)
     - page_size (optional): Number of results per page (default: 5, max: 50)
+    - cursor (optional): Opaque token from a previous response's 'next_cursor'. Overrides 'page'.
     - dir (optional): Directory name to search in (default: "documents1"). Use for single directory.
     - dirs (optional): Comma-separated list of directories to search (e.g., "documents1,documents2").
                       If provided, overrides 'dir' parameter. Allows searching multiple directories.
     - include_scores (optional): If "true", return results with distance scores (default: false)
-    - distance_threshold (optional): Filter results by maximum distance (lower = better match, default: no filter)
+    - distance_threshold (optional): Filter results by maximum cosine distance, i.e. 1 - cosine similarity
+                      (0-2, lower = better match, default: no filter). Indexes used to report squared L2
+                      distance (twice this), so halve any threshold tuned before the switch.
     - use_reranker (optional): If "true", use reranker to improve ranking (default: true). If "false", use distance-based ranking only.
     
     Returns JSON with the query and list of matching file paths.
-    If pagination is used, also returns page, page_size, and has_next.
+    If pagination is used, also returns page, page_size, has_next and next_cursor.
     If include_scores=true, results are dicts with 'path' and 'distance'.
+    
+    Responses carry an ETag that changes when any searched directory is reindexed;
+    a request with a matching If-None-Match gets 304 Not Modified.
     """
     q = request.GET.get("q", "").strip()
     
@@ -53,178 +245,88 @@ def api_search(request):
     # distance_threshold: Filter results - only return files with distance <= threshold
     #                     Lower distance = better match (e.g., 0.2 is better than 0.8)
     #                     If not specified, return all results
-    distance_threshold_str = request.GET.get("distance_threshold")
-    distance_threshold = None
-    if distance_threshold_str:
-        try:
-            distance_threshold = max(0.0, float(distance_threshold_str))  # Ensure non-negative
-        except ValueError:
-            pass  # Invalid number, ignore threshold
+    #                     Invalid numbers are ignored; negative values are clamped to 0
+    distance_threshold = _get_float(request, "distance_threshold")
     
     # use_reranker: If true, use reranker to improve ranking accuracy (default: true)
     use_reranker = request.GET.get("use_reranker", "true").lower() == "true"
 
-    # Helper to compute an overall confidence score/label from reranker scores.
-    # We look at the maximum rerank_score across all results (if present).
-    def _compute_confidence(result_items):
-        best_score = 0.0
-        if isinstance(result_items, list):
-            for r in result_items:
-                if isinstance(r, dict):
-                    s = float(r.get("rerank_score", 0.0) or 0.0)
-                    if s > best_score:
-                        best_score = s
-        # Map numeric score to coarse confidence level
-        if best_score >= 0.8:
-            level = "high"
-        elif best_score >= 0.3:
-            level = "medium"
-        else:
-            level = "low"
-        return best_score, level
-    
     # Check if pagination parameters are provided
     page_str = request.GET.get("page")
     size_str = request.GET.get("page_size")
+    cursor_str = request.GET.get("cursor")
     
-    if page_str or size_str:
+    paginate = bool(page_str or size_str or cursor_str)
+    
+    if paginate:
         # Pagination mode
-        try:
-            page = max(1, int(page_str or "1"))
-        except ValueError:
-            page = 1 #default to 1
-        
-        try:
-            page_size = min(50, max(1, int(size_str or "5")))
-        except ValueError:
-            page_size = 5 #default to 5
-        
-        # Fetch one extra item to determine if there's a next page
-        k = min(page * page_size + 1, 200)
-        
-        # DISTANCE / SCORE FETCHING LOGIC:
-        # If user wants scores, wants to filter by threshold, OR wants reranker-based
-        # confidence, we need full result dicts (with distances and rerank_score).
-        need_distances = include_scores or (distance_threshold is not None) or use_reranker
-        all_results_raw = search_files(
-            q,
-            k=k,
-            directory=directories,
-            include_distances=need_distances,
-            use_reranker=use_reranker,
-        )
+        page = _get_int(request, "page", default=1, lo=1)
+        page_size = _get_int(request, "page_size", default=5, lo=1, hi=50)
         
-        # Compute query-level confidence from reranker scores (if available).
-        query_conf_score, query_conf_level = _compute_confidence(all_results_raw)
-        
-        # Work on a copy we can mutate without losing the raw data used for confidence.
-        all_results = list(all_results_raw)
-        
-        # Apply distance threshold filter if specified
-        # Example: threshold=0.3 means "only show results with distance <= 0.3"
-        if distance_threshold is not None:
-            if include_scores:
-                # Results are dicts: [{"path": "...", "distance": 0.2}, ...]
-                # Filter: keep only results where distance <= threshold
-                all_results = [
-                    r
-                    for r in all_results
-                    if isinstance(r, dict)
-                    and r.get("distance", float("inf")) <= distance_threshold
-                ]
-            else:
-                # Results are dicts but user doesn't want scores in response
-                # Filter first, then extract just paths
-                filtered = [
-                    r
-                    for r in all_results
-                    if isinstance(r, dict)
-                    and r.get("distance", float("inf")) <= distance_threshold
-                ]
-                all_results = [r["path"] for r in filtered]
-        elif not include_scores:
-            # No threshold, but user doesn't want scores
-            # Convert dicts to paths: [{"path": "..."}, ...] → ["...", ...]
-            all_results = [r["path"] if isinstance(r, dict) else r for r in all_results]
-        
-        # Slice results for the requested page
+        # Cursor (if valid) takes precedence over page number
         start = (page - 1) * page_size
-        end = start + page_size
-        items = all_results[start:end]
-        has_next = len(all_results) > end
+        if cursor_str:
+            offset = _decode_cursor(cursor_str)
+            if offset is not None:
+                start = offset
+                page = start // page_size + 1
         
-        return JsonResponse(
-            {
-                "query": q,
-                "directories": directories,
-                "page": page,
-                "page_size": page_size,
-                "has_next": has_next,
-                "results": items,
-                # Reranker-based confidence for the query as a whole.
-                "query_confidence_score": query_conf_score,
-                "query_confidence_level": query_conf_level,
-            }
-        )
+        # Always retrieve the same top-K so every page of this query hits the
+        # same cache entry; pages are then just slices of that list.
+        k = PAGINATION_TOP_K
     else:
-        # Legacy mode: use k parameter
-        k_str = request.GET.get("k", "5")
-        
-        # Validate and clamp k parameter
-        try:
-            k = max(1, min(50, int(k_str)))
-        except ValueError:
-            k = 5
-        
-        # DISTANCE / SCORE FETCHING LOGIC (same as pagination mode above)
-        # Get distances if user wants scores, wants to filter by threshold,
-        # OR wants reranker-based confidence.
-        need_distances = include_scores or (distance_threshold is not None) or use_reranker
-        results_raw = search_files(
-            q,
-            k=k,
-            directory=directories,
-            include_distances=need_distances,
-            use_reranker=use_reranker,
-        )
-        
-        # Compute query-level confidence from reranker scores (if available).
-        query_conf_score, query_conf_level = _compute_confidence(results_raw)
-        
-        # Work on a copy we can mutate without losing the raw data used for confidence.
-        results = list(results_raw)
-        
-        # Apply distance threshold filter if specified
-        if distance_threshold is not None:
-            if include_scores:
-                # Keep dicts with distance, but filter by threshold
-                results = [
-                    r
-                    for r in results
-                    if isinstance(r, dict)
-                    and r.get("distance", float("inf")) <= distance_threshold
-                ]
-            else:
-                # Filter dicts, then extract just paths
-                filtered = [
-                    r
-                    for r in results
-                    if isinstance(r, dict)
-                    and r.get("distance", float("inf")) <= distance_threshold
-                ]
-                results = [r["path"] for r in filtered]
-        elif not include_scores:
-            # No threshold, convert dicts to paths for backward compatibility
-            results = [r["path"] if isinstance(r, dict) else r for r in results]
-        
-        return JsonResponse(
-            {
-                "query": q,
-                "directories": directories,
-                "results": results,
-                # Reranker-based confidence for the query as a whole.
-                "query_confidence_score": query_conf_score,
-                "query_confidence_level": query_conf_level,
-            }
-        )
-
+        # Legacy mode: use k parameter (validated and clamped to 1..50)
+        k = _get_int(request, "k", default=5, lo=1, hi=50)
+    
+    # Conditional GET: if the client already has this exact response (same
+    # parameters, no reindex since), answer 304 without searching at all
+    versions = await asyncio.to_thread(_index_versions, directories)
+    etag = _search_etag(
+        versions, q, k, include_scores, distance_threshold, use_reranker,
+        paginate, start if paginate else None, page_size if paginate else None,
+    )
+    if request.META.get("HTTP_IF_NONE_MATCH") == etag:
+        not_modified = HttpResponse(status=304)
+        not_modified["ETag"] = etag
+        not_modified["Cache-Control"] = SEARCH_CACHE_CONTROL
+        return not_modified
+    
+    # DISTANCE / SCORE FETCHING LOGIC:
+    # If user wants scores OR wants reranker-based confidence, we need full
+    # result dicts (with distances and rerank_score). Threshold filtering is
+    # done inside search_files, so it doesn't need dicts here.
+    need_distances = include_scores or use_reranker
+    results_raw = await asyncio.to_thread(
+        _cached_search, q, directories, k, need_distances, use_reranker, distance_threshold, versions
+    )
+    
+    # Compute query-level confidence from reranker scores (if available).
+    query_conf_score, query_conf_level = _compute_confidence(results_raw)
+    
+    results = _project(results_raw, include_scores)
+    
+    response = {
+        "query": q,
+        "directories": directories,
+        "results": results,
+        # Reranker-based confidence for the query as a whole.
+        "query_confidence_score": query_conf_score,
+        "query_confidence_level": query_conf_level,
+    }
+    
+    if paginate:
+        # Slice results for the requested page
+        end = start + page_size
+        has_next = len(results) > end
+        response.update({
+            "page": page,
+            "page_size": page_size,
+            "has_next": has_next,
+            "next_cursor": _encode_cursor(end) if has_next else None,
+            "results": results[start:end],
+        })
+    
+    json_response = JsonResponse(response)
+    json_response["ETag"] = etag
+    json_response["Cache-Control"] = SEARCH_CACHE_CONTROL
+    return json_response
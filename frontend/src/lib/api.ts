@@ -27,6 +27,7 @@ export interface SearchResponse {
   page: number;
   page_size: number;
   has_next: boolean;
+  next_cursor?: string | null;
   results: string[];
 }
 
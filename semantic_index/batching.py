@@ -0,0 +1,78 @@
+"""
+Micro-batching helper - fuses model calls requested at about the same time (e.g. by
+concurrent HTTP requests) into one call, shared by query embedding and reranking.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, List, Optional, Tuple
+
+
+class MicroBatcher:
+    """
+    Base class for a worker thread that processes queued items in batches.
+
+    Callers submit() an item and block on the returned Future. A daemon worker
+    thread (started on first use) blocks for one item, collects more until
+    _window() seconds have passed or _max_batch() items are pending, and passes
+    them all to _process(), which must resolve every item's Future.
+
+    Subclasses read their window and batch limit from module constants in the
+    hooks below, so the values can be changed (or patched) at runtime.
+    """
+
+    thread_name = "micro-batcher"
+
+    def __init__(self):
+        self._queue: "queue.Queue[Tuple[Any, Future]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def submit(self, item: Any) -> Future:
+        """Queue one item; the Future resolves to whatever _process() sets for it."""
+        future: Future = Future()
+        self._queue.put((item, future))
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.thread_name, daemon=True)
+                self._thread.start()
+        return future
+
+    def _window(self) -> float:
+        """How long to wait for more items after the first one (seconds)."""
+        raise NotImplementedError
+
+    def _max_batch(self) -> Optional[int]:
+        """Most items processed together (None for no limit)."""
+        return None
+
+    def _process(self, items: List[Tuple[Any, Future]]):
+        """Process one batch and resolve each item's Future."""
+        raise NotImplementedError
+
+    def _drain(self) -> List[Tuple[Any, Future]]:
+        """Block for one item, then collect more until the window closes or the batch is full."""
+        items = [self._queue.get()]
+        deadline = time.monotonic() + self._window()
+        max_batch = self._max_batch()
+        while max_batch is None or len(items) < max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                items.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return items
+
+    def _run(self):
+        while True:
+            items = self._drain()
+            try:
+                self._process(items)
+            except Exception as e:
+                # Never leave a caller blocked: fail whatever _process didn't resolve
+                for _, future in items:
+                    if not future.done():
+                        future.set_exception(e)
@@ -0,0 +1,149 @@
+"""
+Text extraction module - reads PDF and text files and splits them into overlapping
+chunks for indexing.
+
+Only needs PyMuPDF (no embedding model or ChromaDB), so the indexer's extraction
+worker processes start quickly.
+"""
+from pathlib import Path
+from typing import Iterable, Iterator, List
+import json
+import os
+import fitz  # PyMuPDF
+
+CHUNK_SIZE = 1000  # Characters per chunk
+CHUNK_OVERLAP = 200  # Overlap between chunks to preserve context
+STREAM_TEXT_THRESHOLD = 1024 * 1024  # .txt files larger than this are chunked while reading
+TEXT_READ_BLOCK = 256 * 1024  # Characters read per block when streaming a .txt file
+# want to chunk because it's easier to search for chunks than the entire file
+# overlap to preserve context at boundaries
+
+
+def _read_text_file(path: str) -> str:
+    """Read text from a .txt file."""
+    p = Path(path)
+    with p.open("r", encoding="utf-8", errors="ignore") as f:
+        return f.read()
+
+
+def _iter_text_blocks(path: str) -> Iterator[str]:
+    """Yield a .txt file's contents in TEXT_READ_BLOCK-sized pieces."""
+    with Path(path).open("r", encoding="utf-8", errors="ignore") as f:
+        while True:
+            block = f.read(TEXT_READ_BLOCK)
+            if not block:
+                return
+            yield block
+
+
+def _iter_pdf_pages(path: str) -> Iterator[str]:
+    """Yield the text of each page of a PDF file using PyMuPDF."""
+    with fitz.open(path) as pdf:
+        for page in pdf:
+            yield page.get_text()
+
+
+def _read_pdf_text(path: str) -> str:
+    """Extract all text from a PDF file using PyMuPDF."""
+    return "".join(_iter_pdf_pages(path))
+
+
+def _extract_text(path: str) -> str:
+    """Extract text from a file based on its extension (.pdf or .txt)."""
+    suffix = Path(path).suffix.lower()
+    if suffix == ".txt":
+        return _read_text_file(path)
+    if suffix == ".pdf":
+        return _read_pdf_text(path)
+    return ""
+
+
+def _chunk_text(text: str, size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> List[str]:
+    """
+    Split text into overlapping chunks.
+    This allows us to search within large documents and preserve context at boundaries.
+    """
+    text = text or ""
+    n = len(text)
+    if n == 0:
+        return []
+    # Each chunk starts (size - overlap) after the previous one, so it overlaps
+    # the previous chunk by `overlap` chars. Stop once a chunk reaches the end.
+    step = size - overlap
+    return [text[start:start + size] for start in range(0, max(1, n - overlap), step)]
+
+
+def _iter_chunks_from_parts(
+    parts: Iterable[str], size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP
+) -> Iterator[str]:
+    """
+    Chunk a stream of text pieces (e.g. PDF pages) without joining them first.
+    
+    Produces exactly the same chunks as _chunk_text("".join(parts)), but only keeps
+    a rolling buffer of roughly one chunk plus one piece in memory.
+    """
+    step = size - overlap
+    buf = ""
+    emitted = False
+    for part in parts:
+        buf += part  # buf stays small (leftover + one page), so this isn't quadratic
+        pos = 0
+        while len(buf) - pos >= size:
+            yield buf[pos:pos + size]
+            emitted = True
+            pos += step
+        buf = buf[pos:]
+    # Final partial chunk: always emit the first chunk of a non-empty text, otherwise
+    # only if it contains more than the overlap already covered by the previous chunk
+    if buf and (not emitted or len(buf) > overlap):
+        yield buf
+
+
+def _iter_pdf_chunks(path: str, size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> Iterator[str]:
+    """Chunk a PDF page by page, without building the full-document string."""
+    return _iter_chunks_from_parts(_iter_pdf_pages(path), size, overlap)
+
+
+def _extract_chunks(path: str) -> List[str]:
+    """Extract and chunk a file based on its extension (.pdf or .txt)."""
+    p = Path(path)
+    suffix = p.suffix.lower()
+    if suffix == ".pdf":
+        return list(_iter_pdf_chunks(path))
+    if suffix == ".txt" and p.stat().st_size > STREAM_TEXT_THRESHOLD:
+        # Large text files are chunked block by block so the whole file is never
+        # held as one string next to its chunks
+        return list(_iter_chunks_from_parts(_iter_text_blocks(path)))
+    return _chunk_text(_extract_text(path))
+
+
+def _extract_chunks_cached(path: str, key: str, cache_dir: str) -> List[str]:
+    """
+    Return a file's chunks from the on-disk text cache, extracting (and caching)
+    them on a miss. Runs in the indexer's extraction worker processes.
+    
+    Args:
+        path: File to extract
+        key: The file's cache key (changes when the file or chunking parameters change)
+        cache_dir: Directory holding the cached chunk lists (one per indexed directory under the indexer's TEXT_CACHE_DIR)
+    
+    Returns:
+        The file's chunks
+    """
+    cache_file = Path(cache_dir) / f"{key}.json"
+    try:
+        with cache_file.open("r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        pass
+    chunks = _extract_chunks(path)
+    try:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temp file and rename, so a concurrent reader never sees a partial file
+        tmp_file = cache_file.with_suffix(f".{os.getpid()}.tmp")
+        with tmp_file.open("w", encoding="utf-8") as f:
+            json.dump(chunks, f, ensure_ascii=False)
+        os.replace(tmp_file, cache_file)
+    except OSError as e:
+        print(f"Warning: Could not write text cache for {path}: {e}")
+    return chunks
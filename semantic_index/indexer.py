@@ -3,29 +3,88 @@ Semantic indexing module - handles reading files, chunking text, creating embedd
 and storing them in ChromaDB for semantic search.
 """
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import hashlib
+import multiprocessing
 import os
+import sys
 import chromadb
-import fitz  # PyMuPDF
+import numpy as np
 import time  # Added: for time.sleep() to add artificial delay (slow mode for testing)
-from typing import List, Optional, Callable  # Added: Optional and Callable for progress callback
-from functools import lru_cache
+from typing import Dict, List, Optional, Callable  # Added: Optional and Callable for progress callback
+from functools import lru_cache, wraps
+from urllib.parse import quote
+# Let the Rust tokenizer batch in parallel (must be set before tokenizers is imported)
+os.environ.setdefault("TOKENIZERS_PARALLELISM", "true")
+import torch
 from sentence_transformers import SentenceTransformer
+from .extract import CHUNK_SIZE, CHUNK_OVERLAP, _extract_chunks_cached
 
 # Configuration constants
 BASE_DIR = Path(__file__).resolve().parents[1]
+_BASE_RESOLVED = BASE_DIR.resolve()  # Resolved once; indexed directories must lie under it
 CHROMA_DIR = BASE_DIR / ".chroma"
+TEXT_CACHE_DIR = CHROMA_DIR / "textcache"  # Extracted chunks per directory and file, keyed by path/mtime/size
+VERSION_DIR = CHROMA_DIR / "versions"  # One file per directory, rewritten after each index run
+# Opt-in: also keep every directory's chunks in one shared collection (tagged with
+# a "dir" metadata field) so a multi-directory search is a single query
+UNIFIED_COLLECTION = os.getenv("SEMANTIC_UNIFIED_COLLECTION") == "1"
+# Per-directory collections are named "files_<dir>"; this name can't be produced by
+# any directory (a directory called "all" would otherwise share "files_all")
+UNIFIED_COLLECTION_NAME = "unified_files"
+# HNSW candidate list size at query time. Recall is governed by this, not by how
+# many results a query asks for, so searches can fetch only what they need.
+HNSW_SEARCH_EF = 128
+# Embeddings are L2-normalized at encode time, so inner product equals cosine
+# similarity and HNSW can use a plain dot product per comparison.
+# Distances are then 1 - cosine similarity (0 = identical, lower = better).
+HNSW_SPACE = "ip"
 
 # Default sentence-transformers model for creating embeddings.
 # We use a stronger retrieval model than all-MiniLM to improve initial recall
 # before reranking. Can be overridden via the SEMANTIC_EMBEDDING_MODEL env var.
 DEFAULT_EMBEDDING_MODEL = "BAAI/bge-small-en-v1.5"
 EMBEDDING_MODEL = os.getenv("SEMANTIC_EMBEDDING_MODEL", DEFAULT_EMBEDDING_MODEL)
+# Inference backend for the embedding model: "torch" (default) or "onnx".
+# ONNX Runtime is typically several times faster on CPU but is opt-in because it
+# needs extra packages: pip install "sentence-transformers[onnx]"
+EMBEDDING_BACKEND = os.getenv("SEMANTIC_BACKEND", "torch").lower()
+# Optional ONNX file inside the model repo (e.g. "onnx/model_O3.onnx" for an
+# optimized export). If unset, sentence-transformers uses onnx/model.onnx or exports one.
+ONNX_FILE_NAME = os.getenv("SEMANTIC_ONNX_FILE")
+# Intra-op threads for PyTorch inference (defaults to all cores)
+TORCH_THREADS = int(os.getenv("SEMANTIC_TORCH_THREADS", os.cpu_count() or 1))
 MAX_FILES = 200  # Safety limit to prevent accidentally indexing too many files
-CHUNK_SIZE = 1000  # Characters per chunk
-CHUNK_OVERLAP = 200  # Overlap between chunks to preserve context
 SUPPORTED_EXTS = {".pdf", ".txt"}
-# want to chunk because it's easier to search for chunks than the entire file
-# overlap to preserve context at boundaries
+ENCODE_BATCH_SIZE_GPU = 128  # Chunks per model.encode mini-batch on GPU
+ENCODE_BATCH_SIZE_CPU = 32  # Smaller mini-batches on CPU keep padding waste and memory low
+EXTRACT_WORKERS = min(os.cpu_count() or 1, 4)  # Processes used for text extraction
+# Recycle extraction workers after N files to cap PyMuPDF memory growth. Workers are
+# spawned and only import the light .extract module, so recycling them is cheap.
+EXTRACT_TASKS_PER_WORKER = 8
+
+def _configure_torch():
+    """Set PyTorch thread counts for inference (must run before the model is used)."""
+    torch.set_num_threads(TORCH_THREADS)
+    try:
+        # Only allowed once, before any inter-op parallel work has started
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass
+
+
+def _inference_only(model: SentenceTransformer) -> SentenceTransformer:
+    """Make every model.encode() call run under torch.inference_mode() (no autograd bookkeeping)."""
+    encode = model.encode
+    
+    @wraps(encode)
+    def encode_without_grad(*args, **kwargs):
+        with torch.inference_mode():
+            return encode(*args, **kwargs)
+    
+    model.encode = encode_without_grad
+    return model
+
 
 @lru_cache(maxsize=1)
 def _get_model() -> SentenceTransformer:
@@ -34,90 +93,224 @@ def _get_model() -> SentenceTransformer:
     
     The model name comes from the EMBEDDING_MODEL constant, which can be
     overridden at runtime via the SEMANTIC_EMBEDDING_MODEL environment variable.
+    
+    With SEMANTIC_BACKEND=onnx the model runs on ONNX Runtime instead of PyTorch
+    (same embeddings, so existing indexes stay valid). The ONNX file is downloaded
+    (or exported) once into the Hugging Face cache. If the ONNX backend can't be
+    loaded we fall back to the default PyTorch backend.
+    
+    PyTorch thread counts are set from SEMANTIC_TORCH_THREADS, and encode() is
+    wrapped to always run under torch.inference_mode(). The PyTorch model is placed
+    on the GPU when one is available and put in eval mode.
     """
-    return SentenceTransformer(EMBEDDING_MODEL)
+    _configure_torch()
+    if EMBEDDING_BACKEND == "onnx":
+        model_kwargs = {"provider": "CPUExecutionProvider"}
+        if ONNX_FILE_NAME:
+            model_kwargs["file_name"] = ONNX_FILE_NAME
+        try:
+            return _inference_only(
+                SentenceTransformer(EMBEDDING_MODEL, backend="onnx", model_kwargs=model_kwargs)
+            )
+        except Exception as e:
+            print(f"Warning: ONNX backend unavailable, falling back to PyTorch: {e}")
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    model = SentenceTransformer(EMBEDDING_MODEL, device=device)
+    model.eval()  # No dropout etc.; sentence-transformers loads in eval mode, but be explicit
+    return _inference_only(model)
 
 
-def _read_text_file(path: str) -> str:
-    """Read text from a .txt file."""
-    p = Path(path)
-    with p.open("r", encoding="utf-8", errors="ignore") as f:
-        return f.read()
+def _file_key(path: Path) -> str:
+    """
+    Cache key for a file's extracted chunks: changes whenever the file (by path,
+    mtime and size) or the chunking parameters change.
+    """
+    st = path.stat()
+    raw = f"{path}|{st.st_mtime_ns}|{st.st_size}|{CHUNK_SIZE}|{CHUNK_OVERLAP}"
+    return hashlib.blake2b(raw.encode(), digest_size=16).hexdigest()
 
 
-def _read_pdf_text(path: str) -> str:
-    """Extract all text from a PDF file using PyMuPDF."""
-    text = ""
-    with fitz.open(path) as pdf:
-        for page in pdf:
-            text += page.get_text()
-    return text
+def _resolve_documents_dir(directory: str) -> Path:
+    """
+    Resolve a directory name to an absolute path at or under the project root.
+    
+    Raises:
+        ValueError: if the directory resolves outside the project root
+            (e.g. "../../tmp/x", or a symlink pointing elsewhere)
+    """
+    documents_dir = (_BASE_RESOLVED / directory).resolve()
+    if documents_dir != _BASE_RESOLVED and _BASE_RESOLVED not in documents_dir.parents:
+        raise ValueError(f"Directory '{directory}' is outside the project directory")
+    return documents_dir
+
+
+def _list_files(documents_dir: Path) -> List[Path]:
+    """
+    Find all PDF and text files in the specified documents folder.
+    
+    documents_dir must already be resolved (see _resolve_documents_dir). os.walk
+    doesn't descend into symlinked directories, and symlinked files pointing
+    outside documents_dir are skipped, so every returned path really lies under it.
+    """
+    documents_dir.mkdir(parents=True, exist_ok=True)
+    # One walk over the tree, filtering by extension as we go (instead of one rglob per extension)
+    files: List[Path] = [
+        Path(root) / name
+        for root, _, names in os.walk(documents_dir)
+        for name in names
+        if os.path.splitext(name)[1].lower() in SUPPORTED_EXTS
+    ]
+    # Only symlinks need resolving; a plain lstat per file is enough to find them
+    files = [f for f in files if not f.is_symlink() or f.resolve().is_relative_to(documents_dir)]
+    files.sort()
+    return files[:MAX_FILES]
 
 
-def _extract_text(path: str) -> str:
-    """Extract text from a file based on its extension (.pdf or .txt)."""
-    suffix = Path(path).suffix.lower()
-    if suffix == ".txt":
-        return _read_text_file(path)
-    if suffix == ".pdf":
-        return _read_pdf_text(path)
-    return ""
+def _relative_path(p: Path, documents_dir: Path) -> str:
+    """
+    Convert absolute path to relative path from project root (e.g., 'documents/file.pdf').
+    
+    documents_dir is the resolved, already-checked directory being indexed (see
+    _resolve_documents_dir).
+    """
+    # Paths from _list_files(documents_dir) lie under it, so a plain prefix strip is
+    # enough; anything else is resolved (stats every component) and must still be
+    # inside the project root
+    if p.is_relative_to(documents_dir):
+        return str(p.relative_to(_BASE_RESOLVED))
+    return str(p.resolve().relative_to(_BASE_RESOLVED))
 
 
-def _chunk_text(text: str, size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> List[str]:
+def _chunk_id(rel: str, chunk_index: int) -> str:
     """
-    Split text into overlapping chunks.
-    This allows us to search within large documents and preserve context at boundaries.
+    Stable fixed-length ID for a chunk (32 hex chars), instead of the long
+    "<path>::chunk-<i>" string. The path and chunk number live in the metadata.
     """
-    text = text or ""
-    n = len(text)
-    if n == 0:
-        return []
-    chunks = []
-    start = 0
-    while start < n:
-        end = min(start + size, n)
-        chunks.append(text[start:end])
-        if end == n:
-            break
-        # Move start forward, but overlap with previous chunk
-        start = max(0, end - overlap)
-    return chunks
+    return hashlib.blake2b(f"{rel}\x00{chunk_index}".encode(), digest_size=16).hexdigest()
 
 
-def _list_files(documents_dir: Path) -> List[Path]:
-    """Find all PDF and text files in the specified documents folder."""
-    documents_dir.mkdir(parents=True, exist_ok=True)
-    files: List[Path] = []
-    for ext in SUPPORTED_EXTS:
-        files.extend(sorted(documents_dir.rglob(f"*{ext}")))
-    return files[:MAX_FILES]
+def _version_file(directory: str) -> Path:
+    """File whose mtime is the directory's index version (shared by all processes)."""
+    return VERSION_DIR / f"{quote(directory, safe='')}.version"
+
+
+def _text_cache_dir(directory: str) -> Path:
+    """Directory holding the extracted-chunk cache files of one indexed directory."""
+    return TEXT_CACHE_DIR / quote(directory, safe="")
+
+
+def _prune_text_cache(cache_dir: Path, keys: List[str]):
+    """Delete cached chunk lists whose key no longer belongs to a current file."""
+    keep = set(keys)
+    for cache_file in cache_dir.glob("*.json"):
+        if cache_file.stem in keep:
+            continue
+        try:
+            cache_file.unlink()
+        except OSError as e:
+            print(f"Warning: Could not remove stale text cache {cache_file}: {e}")
+
+
+def _bump_collection_version(directory: str):
+    """Mark a directory's index as changed (called at the end of every index run)."""
+    VERSION_DIR.mkdir(parents=True, exist_ok=True)
+    _version_file(directory).write_text(str(time.time_ns()))
+
 
+def _collection_metadata() -> dict:
+    """Metadata every collection is created with (embedding model + HNSW settings)."""
+    return {
+        "embedding_model": EMBEDDING_MODEL,
+        "hnsw:space": HNSW_SPACE,
+        "hnsw:search_ef": HNSW_SEARCH_EF,
+    }
 
-def _relative_path(p: Path) -> str:
-    """Convert absolute path to relative path from project root (e.g., 'documents/file.pdf')."""
-    return str(p.resolve().relative_to(BASE_DIR.resolve()))
+
+def _open_collection(client, name: str):
+    """
+    Get or create a collection built with the current embedding model and HNSW settings.
+    
+    If the existing collection was built with a different embedding model its
+    vectors aren't comparable (and HNSW settings are fixed at creation), so on any
+    mismatch it is dropped and rebuilt from scratch.
+    """
+    metadata = _collection_metadata()
+    try:
+        collection = client.get_collection(name=name)
+    except Exception:
+        # Collection doesn't exist yet
+        collection = None
+    if collection is not None:
+        existing = collection.metadata or {}
+        if any(existing.get(key) != value for key, value in metadata.items()):
+            client.delete_collection(name)
+            collection = None
+    if collection is None:
+        collection = client.create_collection(name=name, metadata=metadata)
+    return collection
+
+
+def _sync_unified_collection(client, collection, directory: str, changed: bool, chroma_batch_size: int):
+    """
+    Mirror one directory's chunks into the shared UNIFIED_COLLECTION_NAME collection,
+    tagged with {"dir": directory}, so searches can query every directory at once.
+    
+    Skipped if nothing changed and the directory is already mirrored; otherwise the
+    directory's rows are replaced by a copy (embeddings included) of its own collection.
+    """
+    unified = _open_collection(client, UNIFIED_COLLECTION_NAME)
+    if not changed and unified.get(where={"dir": directory}, limit=1, include=[])["ids"]:
+        return
+    unified.delete(where={"dir": directory})
+    # Copy a page at a time so a large directory's embeddings are never all in memory
+    offset = 0
+    while True:
+        data = collection.get(
+            include=["documents", "metadatas", "embeddings"], limit=chroma_batch_size, offset=offset
+        )
+        ids = data["ids"]
+        if not ids:
+            break
+        unified.add(
+            ids=ids,  # Chunk ids hash the path (which starts with the directory), so they're unique here too
+            documents=data["documents"],
+            embeddings=data["embeddings"],
+            metadatas=[dict(meta, dir=directory) for meta in data["metadatas"]],
+        )
+        offset += len(ids)
 
 
 def index_documents(
     directory: str = "documents1",
     progress_callback: Optional[Callable[[int, int, Optional[str], str], None]] = None,
-    slow_ms: int = 0
+    slow_ms: int = 0,
+    chroma_batch_size: int = 1000
 ) -> int:
     """
     Main indexing function: scans documents folder, extracts text, chunks it,
     creates embeddings, and stores everything in ChromaDB.
     
+    Indexing is incremental: files whose path, mtime and size are unchanged since
+    the last run keep their stored chunks and embeddings, chunks of deleted files
+    are removed, and only new or changed files are extracted and embedded.
+    Extracted chunks are also cached on disk in TEXT_CACHE_DIR; entries of deleted
+    or changed files are pruned at the end of the run.
+    
     Args:
         directory: Name of the directory to index (relative to project root, e.g., "documents1", "documents2")
         progress_callback: Optional callback(current, total, current_file, phase) called during indexing
         slow_ms: Optional artificial delay in milliseconds per file (for testing progress bar)
+        chroma_batch_size: Number of chunks written to ChromaDB per collection.add() call
     
     Returns:
-        The number of chunks indexed.
+        The number of chunks in the directory's collection after indexing.
+    
+    Raises:
+        ValueError: if the directory resolves outside the project root
     """
-    # Resolve the documents directory path
-    documents_dir = BASE_DIR / directory
+    # Resolve the documents directory once (following ".." and symlinks) and refuse
+    # anything outside the project root before touching the index
+    documents_dir = _resolve_documents_dir(directory)
     
     # Set up ChromaDB persistent storage
     CHROMA_DIR.mkdir(parents=True, exist_ok=True)
@@ -126,27 +319,8 @@ def index_documents(
     # Use directory name in collection name to keep different directories separate
     collection_name = f"files_{directory}"
     
-    # Delete existing collection to rebuild from scratch (removes all old files)
-    # This ensures only files currently in the directory are indexed
-    try:
-        client.delete_collection(collection_name)
-    except Exception:
-        # Collection doesn't exist yet, which is fine
-        pass
-    
-    # Create a fresh collection (empty, ready for new data)
-    collection = client.get_or_create_collection(name=collection_name)
-    
-    # Clear any existing data in the collection (in case deletion didn't work)
-    # This is a safety measure to ensure we start with a clean slate
-    try:
-        # Get all existing IDs and delete them
-        existing_data = collection.get()
-        if existing_data and existing_data.get("ids"):
-            collection.delete(ids=existing_data["ids"])
-    except Exception:
-        # Collection is empty or doesn't have data, which is fine
-        pass
+    # Reuse the existing collection so unchanged files don't have to be re-embedded
+    collection = _open_collection(client, collection_name)
 
     # Find all files to index
     files = _list_files(documents_dir)
@@ -157,64 +331,138 @@ def index_documents(
     if progress_callback:
         progress_callback(0, total_files, None, "starting")
     
-    model = _get_model()
+    rels = [_relative_path(f, documents_dir) for f in files]  # e.g., "documents1/file.pdf"
+    keys = [_file_key(f) for f in files]
+    cache_dir = _text_cache_dir(directory)
+    
+    # What's already indexed: chunk 0 of every file carries the file's cache key
+    # (one row per file, so this stays small)
+    indexed = collection.get(where={"chunk": 0}, include=["metadatas"])
+    indexed_keys = {
+        meta["path"]: meta.get("key")
+        for meta in (indexed.get("metadatas") or [])
+        if meta and meta.get("path")
+    }
+    
+    # Files that are new or changed since they were indexed; everything else is kept as is
+    changed = [idx for idx, (rel, key) in enumerate(zip(rels, keys)) if indexed_keys.get(rel) != key]
+    
+    # Drop chunks of changed files and of files that no longer exist in the directory
+    current = set(rels)
+    stale = [path for path in indexed_keys if path not in current]
+    stale.extend(rels[idx] for idx in changed if rels[idx] in indexed_keys)
+    if stale:
+        collection.delete(where={"path": {"$in": stale}})
 
     # Prepare data for ChromaDB
     docs: List[str] = []  # Text chunks
     ids: List[str] = []   # Unique IDs for each chunk
-    metas: List[dict] = []  # Metadata (file path, chunk number)
+    metas: List[dict] = []  # Metadata (file path, chunk number, cache key)
 
-    # Process each file
-    # enumerate(files, start=1) gives us: (1, file1), (2, file2), etc.
-    for file_idx, f in enumerate(files, start=1):
-        # Report progress: "Currently processing file X out of Y"
-        rel = _relative_path(f)  # e.g., "documents1/file.pdf"
-        if progress_callback:
-            # Call the callback: current=file_idx (e.g., 3), total=total_files (e.g., 12)
-            # This updates the progress store so frontend can poll and see 25% complete
-            progress_callback(file_idx, total_files, rel, "reading")
-        
-        # ARTIFICIAL DELAY: For testing the progress bar visually
-        # If slow_ms=250, wait 0.25 seconds per file so you can see the bar move
-        # In production, this would be 0 (no delay)
-        if slow_ms > 0:
-            time.sleep(slow_ms / 1000.0)  # Convert milliseconds to seconds
-        
-        text = _extract_text(str(f))
-        if not text.strip():
+    # Extract and chunk changed files in parallel worker processes (PDF parsing is
+    # CPU-bound). Workers only return the chunk strings; embedding stays in this
+    # process so the embedding model is loaded once.
+    file_chunks: Dict[int, List[str]] = {}
+    done = total_files - len(changed)  # Unchanged files count as already read
+    if changed:
+        # Always spawn (the default with max_tasks_per_child): workers never inherit
+        # this process's model, CUDA context or tokenizer threads
+        pool_kwargs = {
+            "max_workers": min(EXTRACT_WORKERS, len(changed)),
+            "mp_context": multiprocessing.get_context("spawn"),
+        }
+        if sys.version_info >= (3, 11):
+            pool_kwargs["max_tasks_per_child"] = EXTRACT_TASKS_PER_WORKER
+        with ProcessPoolExecutor(**pool_kwargs) as pool:
+            futures = {
+                pool.submit(_extract_chunks_cached, str(files[idx]), keys[idx], str(cache_dir)): idx
+                for idx in changed
+            }
+            
+            # Report progress as files finish (in completion order, not file order)
+            for future in as_completed(futures):
+                idx = futures[future]
+                file_chunks[idx] = future.result()
+                done += 1
+                if progress_callback:
+                    # Call the callback: current=done (e.g., 3), total=total_files (e.g., 12)
+                    # This updates the progress store so frontend can poll and see 25% complete
+                    progress_callback(done, total_files, rels[idx], "reading")
+                
+                # ARTIFICIAL DELAY: For testing the progress bar visually
+                # If slow_ms=250, wait 0.25 seconds per file so you can see the bar move
+                # In production, this would be 0 (no delay)
+                if slow_ms > 0:
+                    time.sleep(slow_ms / 1000.0)  # Convert milliseconds to seconds
+
+    # Process each file in its original order so chunk IDs are deterministic
+    for idx in changed:
+        rel, key, chunks = rels[idx], keys[idx], file_chunks[idx]
+        # Skip files with no text (e.g. scanned PDFs without a text layer)
+        if not any(chunk.strip() for chunk in chunks):
             continue
         
-        # Split file into chunks and add each chunk to the database
-        for i, chunk in enumerate(_chunk_text(text)):
+        # Add each chunk of the file to the database
+        for i, chunk in enumerate(chunks):
             docs.append(chunk)
-            ids.append(f"{rel}::chunk-{i}")
-            metas.append({"path": rel, "chunk": i})
+            ids.append(_chunk_id(rel, i))
+            metas.append({"path": rel, "chunk": i, "key": key})
 
-    if not docs:
+    if docs:
+        model = _get_model()
+        
+        # Create embeddings for all new chunks at once (more efficient)
+        # Report phase change: we're now embedding, not reading files
         if progress_callback:
-            progress_callback(total_files, total_files, None, "completed")
-        return 0
-
-    # Create embeddings for all chunks at once (more efficient)
-    # Report phase change: we're now embedding, not reading files
-    if progress_callback:
-        progress_callback(total_files, total_files, None, "embedding")
-    # For models like BGE, it is recommended to normalize embeddings for
-    # cosine-similarity-based retrieval. This generally makes distances
-    # more comparable and improves retrieval quality.
-    embeddings = model.encode(docs, normalize_embeddings=True).tolist()
-    
-    # Store everything in ChromaDB
-    # Report phase change: we're now storing in database
-    if progress_callback:
-        progress_callback(total_files, total_files, None, "storing")
-    collection.add(documents=docs, embeddings=embeddings, metadatas=metas, ids=ids)
+            progress_callback(total_files, total_files, None, "embedding")
+        # For models like BGE, it is recommended to normalize embeddings for
+        # cosine-similarity-based retrieval. This generally makes distances
+        # more comparable and improves retrieval quality.
+        # encode() already sorts inputs by length internally so each mini-batch is
+        # padded only to its own longest chunk; we just pick a batch size for the device.
+        batch_size = ENCODE_BATCH_SIZE_GPU if model.device.type == "cuda" else ENCODE_BATCH_SIZE_CPU
+        embeddings = model.encode(
+            docs,
+            batch_size=batch_size,
+            normalize_embeddings=True,
+            show_progress_bar=False,
+            convert_to_numpy=True,
+        ).astype(np.float32, copy=False)  # Keep as a float32 array; slices below are zero-copy views
+        
+        # Store everything in ChromaDB
+        # Report phase change: we're now storing in database
+        # Write in batches rather than one giant add(): keeps each insert transaction
+        # (and ChromaDB's memory use while ingesting it) bounded
+        total_chunks = len(ids)
+        for start in range(0, total_chunks, chroma_batch_size):
+            end = min(start + chroma_batch_size, total_chunks)
+            if progress_callback:
+                progress_callback(total_files, total_files, f"chunks {start + 1}-{end} of {total_chunks}", "storing")
+            collection.add(
+                documents=docs[start:end],
+                embeddings=embeddings[start:end],
+                metadatas=metas[start:end],
+                ids=ids[start:end],
+            )
+    
+    if UNIFIED_COLLECTION:
+        _sync_unified_collection(client, collection, directory, bool(docs or stale), chroma_batch_size)
+    
+    # Cache entries of deleted or changed files will never be read again
+    _prune_text_cache(cache_dir, keys)
+    
+    # Let searches (and their HTTP ETags) know this directory's index changed
+    _bump_collection_version(directory)
+    
+    # The collection may have been recreated, so cached search handles can be stale
+    from .search import invalidate_collection  # Imported here: search imports this module
+    invalidate_collection()
     
     # Final progress update: 100% complete
     if progress_callback:
         progress_callback(total_files, total_files, None, "completed")
     
-    return len(ids)
+    return collection.count()
 
 
 # Export model getter for search module
@@ -1,6 +1,6 @@
 """
 Progress tracking module for indexing operations.
-Stores progress in memory, keyed by job_id (UUID).
+Stores progress in a small SQLite database, keyed by job_id (UUID).
 
 This module allows the frontend to track indexing progress by:
 1. Creating a job with start_job() - returns a unique job_id
@@ -8,17 +8,62 @@ This module allows the frontend to track indexing progress by:
 3. Checking progress with get_job() using the job_id
 4. Marking completion with finish_job() or failure with fail_job()
 
-Note: This uses in-memory storage (a Python dictionary). For production with
-multiple servers, you'd want to use Redis or a database instead.
+Note: Indexing runs in a separate worker process, so progress can't live in a
+plain Python dictionary (the web process would never see the worker's updates).
+SQLite in WAL mode lets the worker write while the web process reads. For
+production with multiple servers, you'd want to use Redis instead.
 """
-from typing import Dict, Optional
+from pathlib import Path
+from typing import Optional
 from datetime import datetime
+import json
+import os
+import sqlite3
+import threading
+import time
 import uuid
 
-# In-memory storage for progress tracking
-# Key: job_id (UUID string), Value: dict with progress info
-# This is a module-level variable shared across all requests
-_progress_store: Dict[str, dict] = {}
+# SQLite file shared by the web process and indexing worker processes
+PROGRESS_DB = Path(__file__).resolve().parents[1] / ".progress.sqlite3"
+
+# One connection per thread (sqlite3 connections can't be shared across threads),
+# re-opened after fork since a connection inherited from the parent isn't safe to use
+_local = threading.local()
+
+# update_job() skips writes that would only repeat the same (current, total, phase)
+# within this many seconds of the previous write for the job
+PROGRESS_MIN_INTERVAL = 0.1
+# job_id -> (current, total, phase, time.time() of last write), per process
+_last_write: dict = {}
+
+
+def _connect() -> sqlite3.Connection:
+    """Return this thread's connection to the progress database, creating it if needed."""
+    conn = getattr(_local, "conn", None)
+    if conn is None or getattr(_local, "pid", None) != os.getpid():
+        conn = sqlite3.connect(str(PROGRESS_DB), timeout=5.0, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, data TEXT NOT NULL)")
+        _local.conn = conn
+        _local.pid = os.getpid()
+    return conn
+
+
+def _update(job_id: str, fields: dict):
+    """Merge fields into a stored job (read-modify-write in one transaction). No-op if job is unknown."""
+    conn = _connect()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute("SELECT data FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is not None:
+            data = json.loads(row[0])
+            data.update(fields)
+            conn.execute("UPDATE jobs SET data = ? WHERE job_id = ?", (json.dumps(data), job_id))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
 
 
 def start_job(directory: str, total: int = 0) -> str:
@@ -33,7 +78,7 @@ def start_job(directory: str, total: int = 0) -> str:
         job_id: Unique identifier for this job
     """
     job_id = str(uuid.uuid4())
-    _progress_store[job_id] = {
+    data = {
         "job_id": job_id,
         "directory": directory,
         "status": "indexing",
@@ -42,8 +87,9 @@ def start_job(directory: str, total: int = 0) -> str:
         "percent": 0.0,
         "current_file": None,
         "phase": "starting",
-        "updated_at": datetime.now().isoformat(),
+        "updated_at": time.time(),
     }
+    _connect().execute("INSERT INTO jobs (job_id, data) VALUES (?, ?)", (job_id, json.dumps(data)))
     return job_id
 
 
@@ -61,20 +107,24 @@ def update_job(job_id: str, current: int, total: int, current_file: Optional[str
         current_file: Name of file currently being processed (e.g., "documents1/file.pdf")
         phase: Current phase ("reading", "embedding", "storing")
     """
-    if job_id not in _progress_store:
+    # Throttle: skip the write if nothing but current_file changed very recently
+    now = time.time()
+    last = _last_write.get(job_id)
+    if last is not None and last[:3] == (current, total, phase) and now - last[3] < PROGRESS_MIN_INTERVAL:
         return
+    _last_write[job_id] = (current, total, phase, now)
     
     # Calculate percentage: if 3 out of 12 files done, that's 25%
     percent = (current / total * 100) if total > 0 else 0.0
     
     # Update the stored progress info
-    _progress_store[job_id].update({
+    _update(job_id, {
         "current": current,
         "total": total,
         "percent": round(percent, 1),  # Round to 1 decimal place (e.g., 25.0)
         "current_file": current_file,
         "phase": phase,
-        "updated_at": datetime.now().isoformat(),  # Timestamp for "last updated"
+        "updated_at": now,  # Timestamp for "last updated" (epoch seconds; get_job formats it)
     })
 
 
@@ -86,17 +136,15 @@ def finish_job(job_id: str, total: int):
         job_id: Job identifier
         total: Total number of files processed
     """
-    if job_id not in _progress_store:
-        return
-    
-    _progress_store[job_id].update({
+    _last_write.pop(job_id, None)
+    _update(job_id, {
         "status": "completed",
         "current": total,
         "total": total,
         "percent": 100.0,
         "current_file": None,
         "phase": "completed",
-        "updated_at": datetime.now().isoformat(),
+        "updated_at": time.time(),
     })
 
 
@@ -108,13 +156,11 @@ def fail_job(job_id: str, error: str):
         job_id: Job identifier
         error: Error message
     """
-    if job_id not in _progress_store:
-        return
-    
-    _progress_store[job_id].update({
+    _last_write.pop(job_id, None)
+    _update(job_id, {
         "status": "error",
         "error": error,
-        "updated_at": datetime.now().isoformat(),
+        "updated_at": time.time(),
     })
 
 
@@ -128,7 +174,15 @@ def get_job(job_id: str) -> Optional[dict]:
     Returns:
         Progress dict or None if job not found
     """
-    return _progress_store.get(job_id)
+    row = _connect().execute("SELECT data FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+    if row is None:
+        return None
+    data = json.loads(row[0])
+    # Stored as a float timestamp; only format it for readers
+    updated_at = data.get("updated_at")
+    if isinstance(updated_at, (int, float)):
+        data["updated_at"] = datetime.fromtimestamp(updated_at).isoformat()
+    return data
 
 
 def clear_job(job_id: str):
@@ -138,6 +192,6 @@ def clear_job(job_id: str):
     Args:
         job_id: Job identifier
     """
-    if job_id in _progress_store:
-        del _progress_store[job_id]
+    _last_write.pop(job_id, None)
+    _connect().execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
 
@@ -0,0 +1,187 @@
+"""
+Query server - keeps the ChromaDB client and its collections open in one long-lived
+process and answers search queries for web workers over a UNIX socket.
+
+Run it with:
+    python -m semantic_index.query_server [--socket PATH]
+and start the web server with SEMANTIC_QUERY_SERVER=PATH so searches use it.
+"""
+from multiprocessing.connection import Client, Connection, Listener
+from typing import Any, Dict, List, Optional, Tuple
+import argparse
+import os
+import threading
+import numpy as np
+
+
+# Default socket path (next to the ChromaDB directory) when --socket isn't given
+DEFAULT_SOCKET_NAME = "query.sock"
+
+
+class QueryServerClient:
+    """
+    Client stub for the query server. Each thread keeps its own connection, since a
+    Connection can only carry one request/response exchange at a time.
+    """
+
+    def __init__(self, address: str):
+        self.address = address
+        self._local = threading.local()
+
+    def _connection(self) -> Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = Client(self.address, family="AF_UNIX")
+            self._local.conn = conn
+        return conn
+
+    def _close(self):
+        conn = getattr(self._local, "conn", None)
+        self._local.conn = None
+        if conn is not None:
+            try:
+                conn.close()
+            except OSError:
+                pass
+
+    def call(self, op: str, *args) -> Any:
+        """
+        Send one request and wait for its reply.
+
+        Args:
+            op: Operation name (see _HANDLERS)
+            *args: Operation arguments (must be picklable)
+
+        Returns:
+            The operation's result; re-raises the server's error as RuntimeError
+        """
+        # Reconnect once if the server restarted since this thread last used it
+        for attempt in range(2):
+            try:
+                conn = self._connection()
+                conn.send((op, args))
+                ok, result = conn.recv()
+                break
+            except (EOFError, OSError):
+                self._close()
+                if attempt:
+                    raise
+        if not ok:
+            raise RuntimeError(f"Query server error: {result}")
+        return result
+
+    def query(
+        self,
+        name: str,
+        q_emb: np.ndarray,
+        n_results: int,
+        where: Optional[dict] = None
+    ) -> Optional[Tuple[list, list, list]]:
+        """Query a collection; the embedding is sent as raw float32 bytes."""
+        q_emb = np.ascontiguousarray(q_emb, dtype=np.float32)
+        return self.call("query", name, q_emb.tobytes(), q_emb.shape, n_results, where)
+
+
+_client: Optional[QueryServerClient] = None
+_client_lock = threading.Lock()
+
+
+def get_query_server_client() -> QueryServerClient:
+    """The process-wide client for the SEMANTIC_QUERY_SERVER socket."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = QueryServerClient(os.environ["SEMANTIC_QUERY_SERVER"])
+        return _client
+
+
+def _handle_query(name: str, data: bytes, shape: Tuple[int, ...], n_results: int, where: Optional[dict]):
+    from .search import _local_query
+    q_emb = np.frombuffer(data, dtype=np.float32).reshape(shape)
+    return _local_query(name, q_emb, n_results, where)
+
+
+def _handle_documents(name: str, ids: List[str]) -> Dict[str, str]:
+    from .search import _local_documents
+    return _local_documents(name, ids)
+
+
+def _handle_has_rows(name: str, where: dict) -> bool:
+    from .search import _local_has_rows
+    return _local_has_rows(name, where)
+
+
+def _handle_invalidate():
+    from .search import _invalidate_local
+    _invalidate_local()
+
+
+_HANDLERS = {
+    "query": _handle_query,
+    "documents": _handle_documents,
+    "has_rows": _handle_has_rows,
+    "invalidate": _handle_invalidate,
+}
+
+
+def _serve_connection(conn: Connection):
+    """Answer requests on one client connection until it closes."""
+    with conn:
+        while True:
+            try:
+                op, args = conn.recv()
+            except (EOFError, OSError):
+                return
+            try:
+                reply = (True, _HANDLERS[op](*args))
+            except Exception as e:
+                reply = (False, f"{type(e).__name__}: {e}")
+            try:
+                conn.send(reply)
+            except (EOFError, OSError):
+                return
+
+
+def serve(address: str):
+    """
+    Listen on a UNIX socket and serve queries forever (one thread per connection).
+
+    Args:
+        address: Socket path; a stale socket file from a previous run is replaced
+    """
+    if os.path.exists(address):
+        os.unlink(address)
+
+    # Only the owning user may connect
+    old_umask = os.umask(0o177)
+    try:
+        listener = Listener(address, family="AF_UNIX")
+    finally:
+        os.umask(old_umask)
+
+    print(f"Query server listening on {address}")
+    with listener:
+        while True:
+            try:
+                conn = listener.accept()
+            except OSError as e:
+                print(f"Warning: Query server accept failed: {e}")
+                continue
+            threading.Thread(target=_serve_connection, args=(conn,), daemon=True).start()
+
+
+def main():
+    from .indexer import CHROMA_DIR
+    from .search import _get_client
+
+    parser = argparse.ArgumentParser(description="Serve semantic search queries over a UNIX socket")
+    parser.add_argument("--socket", default=str(CHROMA_DIR / DEFAULT_SOCKET_NAME), help="Socket path")
+    args = parser.parse_args()
+
+    # Open the ChromaDB client before taking connections
+    _get_client()
+    serve(args.socket)
+
+
+if __name__ == "__main__":
+    main()
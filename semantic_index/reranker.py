@@ -1,8 +1,11 @@
 """
 Reranker module - uses BAAI/bge-reranker-v2-m3 to rerank search results for better accuracy.
 """
+import os
+from concurrent.futures import Future
 from typing import List, Dict, Tuple, Optional, Any
 from functools import lru_cache
+from .batching import MicroBatcher
 
 try:
     from FlagEmbedding import FlagReranker
@@ -11,23 +14,119 @@ except ImportError:
 
 # Reranker model configuration
 RERANKER_MODEL = "BAAI/bge-reranker-v2-m3"
+RERANK_BATCH_SIZE_GPU = 128  # Query/chunk pairs per compute_score mini-batch on GPU
+RERANK_BATCH_SIZE_CPU = 32  # Smaller mini-batches on CPU keep padding waste and memory low
+# Opt-in INT8 dynamic quantization of the reranker's Linear layers when running on CPU
+RERANKER_INT8 = os.getenv("SEMANTIC_RERANKER_INT8") == "1"
+# How long the rerank batcher waits for more concurrent requests to fuse (seconds)
+RERANK_BATCH_WINDOW = 0.005
+
+
+@lru_cache(maxsize=1)
+def _cuda_available() -> bool:
+    """Whether a CUDA device is available for the reranker (False if torch is missing)."""
+    try:
+        import torch
+    except ImportError:
+        return False
+    return torch.cuda.is_available()
 
 
 @lru_cache(maxsize=1)
 def _get_reranker():
-    """Load and cache the reranker model (only loads once, reused for all operations)."""
+    """
+    Load and cache the reranker model (only loads once, reused for all operations).
+    
+    Uses FP16 on GPU and FP32 on CPU. With SEMANTIC_RERANKER_INT8=1 the CPU model's
+    Linear layers are dynamically quantized to INT8 for faster scoring.
+    """
     if FlagReranker is None:
         raise ImportError(
             "FlagEmbedding is not installed. Install it with: pip install FlagEmbedding"
         )
-    return FlagReranker(RERANKER_MODEL, use_fp16=True)
+    # FP16 only pays off on GPU; on CPU it's slower than FP32
+    cuda = _cuda_available()
+    reranker = FlagReranker(RERANKER_MODEL, use_fp16=cuda)
+    if not cuda and RERANKER_INT8:
+        try:
+            import torch
+            reranker.model = torch.quantization.quantize_dynamic(
+                reranker.model, {torch.nn.Linear}, dtype=torch.qint8
+            )
+        except Exception as e:
+            print(f"Warning: INT8 quantization of reranker failed, using FP32: {e}")
+    return reranker
+
+
+def _score_pairs(reranker, pairs: List[List[str]], batch_size: int) -> List[float]:
+    """
+    Score query/chunk pairs, returning scores in the same order as pairs.
+    
+    Pairs are scored in order of chunk length so each mini-batch pads to similar
+    lengths, then the scores are put back in the original order.
+    normalize=True applies sigmoid to convert raw logits to 0-1 range.
+    """
+    order = sorted(range(len(pairs)), key=lambda i: len(pairs[i][1]))
+    sorted_scores = reranker.compute_score(
+        [pairs[i] for i in order], normalize=True, batch_size=batch_size
+    )
+    # Handle both single score and list of scores
+    if not isinstance(sorted_scores, list):
+        sorted_scores = [sorted_scores]
+    scores = [0.0] * len(pairs)
+    for i, score in zip(order, sorted_scores):
+        scores[i] = score
+    return scores
+
+
+class _RerankBatcher(MicroBatcher):
+    """
+    Fuses reranking requests that arrive within RERANK_BATCH_WINDOW of each other
+    into a single compute_score() call, then splits the scores back per request.
+    """
+    
+    thread_name = "rerank-batcher"
+    
+    def submit(self, pairs: List[List[str]], batch_size: int) -> Future:
+        """Queue pairs for scoring; the Future resolves to their scores (same order)."""
+        return super().submit((pairs, batch_size))
+    
+    def _window(self) -> float:
+        return RERANK_BATCH_WINDOW
+    
+    def _process(self, items: List[Tuple[Tuple[List[List[str]], int], Future]]):
+        # Requests asking for different mini-batch sizes are scored separately
+        by_batch_size: Dict[int, List[Tuple[List[List[str]], Future]]] = {}
+        for (pairs, batch_size), future in items:
+            by_batch_size.setdefault(batch_size, []).append((pairs, future))
+        for batch_size, group in by_batch_size.items():
+            self._score_group(group, batch_size)
+    
+    def _score_group(self, group: List[Tuple[List[List[str]], Future]], batch_size: int):
+        all_pairs = [pair for pairs, _ in group for pair in pairs]
+        try:
+            scores = _score_pairs(_get_reranker(), all_pairs, batch_size)
+        except Exception as e:
+            # Only this group fails; other batch sizes are still scored
+            for _, future in group:
+                future.set_exception(e)
+            return
+        # Hand each request back its own slice of the fused scores
+        offset = 0
+        for pairs, future in group:
+            future.set_result(scores[offset:offset + len(pairs)])
+            offset += len(pairs)
+
+
+_batcher = _RerankBatcher()
 
 
 def rerank_files(
     query: str,
     file_results: List[Dict[str, Any]],
     chunk_texts: Dict[str, str],
-    top_k: Optional[int] = None
+    top_k: Optional[int] = None,
+    batch_size: Optional[int] = None
 ) -> List[Dict[str, Any]]:
     """
     Rerank file search results using the BAAI reranker model.
@@ -37,6 +136,7 @@ def rerank_files(
         file_results: List of file result dicts with 'path' and optionally 'distance'
         chunk_texts: Dict mapping file paths to their best matching chunk text
         top_k: Optional limit on number of results to return after reranking
+        batch_size: Pairs scored per model mini-batch (default: 128 on GPU, 32 on CPU)
     
     Returns:
         List of file result dicts, reranked by relevance score (highest first).
@@ -82,14 +182,12 @@ def rerank_files(
         print(f"Warning: No valid pairs for reranking (file_results: {len(file_results)}, chunk_texts: {len(chunk_texts)})")
         return file_results
     
-    # Compute reranker scores
-    # normalize=True applies sigmoid to convert raw logits to 0-1 range
-    # Higher scores (closer to 1) = better relevance match
+    # Compute reranker scores (0-1 range, higher = better relevance match).
+    # Concurrent searches are fused into one compute_score() call by the batcher.
+    if batch_size is None:
+        batch_size = RERANK_BATCH_SIZE_GPU if _cuda_available() else RERANK_BATCH_SIZE_CPU
     try:
-        scores = reranker.compute_score(pairs, normalize=True)
-        # Handle both single score and list of scores
-        if not isinstance(scores, list):
-            scores = [scores]
+        scores = _batcher.submit(pairs, batch_size).result()
     except Exception as e:
         # If reranking fails, return original results
         print(f"Warning: Reranking computation failed, using original results: {e}")
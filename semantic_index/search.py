@@ -1,27 +1,326 @@
 """
 Semantic search module - queries the vector database to find files matching a search query.
 """
-from typing import List, Dict, Optional, Tuple
+from typing import List, Dict, NamedTuple, Optional, Tuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
+import heapq
+import os
+import threading
 import chromadb
-from .indexer import CHROMA_DIR, get_model
-from .reranker import rerank_files
+from chromadb.api.models.Collection import Collection
+import numpy as np
+from .batching import MicroBatcher
+from .query_server import get_query_server_client
+from .indexer import (
+    CHROMA_DIR, EMBEDDING_MODEL, UNIFIED_COLLECTION, UNIFIED_COLLECTION_NAME, VERSION_DIR, get_model, _version_file
+)
+from .reranker import rerank_files, _get_reranker
 
 
-def _dedupe_preserve_order(items: List[str]) -> List[str]: # Not used
-    """Remove duplicates from a list while preserving the original order."""
+# Query embedding micro-batching: how long to wait for concurrent queries (seconds)
+# and the most queries encoded in one forward pass
+EMBED_BATCH_WINDOW = 0.005
+EMBED_MAX_BATCH = 32
+
+class Hit(NamedTuple):
+    """A file-level search result: the file's path and its best chunk distance."""
+    path: str
+    distance: float
+
+
+# Fields requested from Chroma per query. Embeddings are never needed, and chunk
+# texts ("documents") are fetched afterwards, only for chunks the reranker will see.
+QUERY_INCLUDE = ("metadatas", "distances")
+
+
+@lru_cache(maxsize=1024)
+def _embed_query(model_name: str, query: str) -> np.ndarray:
+    """
+    Embed a query string, caching the result so repeated queries (e.g. paging
+    through results) skip the transformer forward pass.
+    
+    The model name is part of the cache key so a model change never returns stale vectors.
+    Returns a read-only, contiguous float32 array of shape (1, dim) that can be passed
+    to Chroma's query_embeddings as is (no conversion to Python lists).
+    """
+    # Cache misses go through the batcher, so concurrent searches share one forward pass
+    emb = _EMBED_BATCHER.encode(query)
+    emb.setflags(write=False)  # Shared by every cache hit, so nobody may modify it
+    return emb
+
+
+class _EmbedBatcher(MicroBatcher):
+    """
+    Groups query embeddings requested at about the same time (e.g. concurrent
+    /api/search requests) into a single model.encode() call: up to EMBED_MAX_BATCH
+    queries arriving within EMBED_BATCH_WINDOW share one forward pass, and each
+    caller gets its own row.
+    """
+    
+    thread_name = "embed-batcher"
+    
+    def encode(self, query: str) -> np.ndarray:
+        """Embed one query; returns a contiguous float32 array of shape (1, dim)."""
+        return self.submit(query).result()
+    
+    def _window(self) -> float:
+        return EMBED_BATCH_WINDOW
+    
+    def _max_batch(self) -> Optional[int]:
+        return EMBED_MAX_BATCH
+    
+    def _process(self, items: List[Tuple[str, Future]]):
+        texts = [query for query, _ in items]
+        # Use normalized embeddings to match how documents were indexed, so that
+        # cosine-distance-based similarity behaves as expected.
+        embs = get_model().encode(
+            texts,
+            batch_size=len(texts),
+            normalize_embeddings=True,
+            convert_to_numpy=True,
+            show_progress_bar=False,
+        )
+        embs = np.asarray(embs, dtype=np.float32)
+        for i, (_, future) in enumerate(items):
+            # Copy each row so cached embeddings don't keep the whole batch alive
+            future.set_result(np.array(embs[i:i + 1], dtype=np.float32, order="C"))
+
+
+_EMBED_BATCHER = _EmbedBatcher()
+
+
+# ChromaDB handles, opened once per process and shared by every search.
+# _COLLECTIONS maps collection name -> Collection, or None if it doesn't exist,
+# so repeated searches of a missing directory don't hit SQLite again.
+# _HANDLES_VERSION is the set of directory index versions the handles were opened
+# at; any reindex (from any process) changes it and the handles are reopened.
+_CLIENT = None
+_COLLECTIONS: Dict[str, Optional[Collection]] = {}
+_HANDLES_VERSION: Optional[frozenset] = None
+# Unified mode: directory name -> whether it's mirrored into the shared collection
+_UNIFIED_DIRS: Dict[str, bool] = {}
+_handles_lock = threading.Lock()
+
+# Opt-in: run ChromaDB queries in a separate long-lived process (see query_server.py)
+# listening on this UNIX socket path, instead of opening the index in this process
+QUERY_SERVER_SOCKET = os.getenv("SEMANTIC_QUERY_SERVER")
+
+# Threads used to query several directories' collections concurrently
+QUERY_WORKERS = min(8, os.cpu_count() or 1)
+_QUERY_POOL: Optional[ThreadPoolExecutor] = None
+
+
+def _get_client():
+    """Open the ChromaDB client on first use and reuse it for every search."""
+    global _CLIENT
+    with _handles_lock:
+        if _CLIENT is None:
+            _CLIENT = chromadb.PersistentClient(path=str(CHROMA_DIR))
+        return _CLIENT
+
+
+def _index_versions() -> frozenset:
+    """Every indexed directory's version file and mtime (see get_collection_version)."""
+    try:
+        with os.scandir(VERSION_DIR) as entries:
+            return frozenset((entry.name, entry.stat().st_mtime_ns) for entry in entries)
+    except OSError:
+        return frozenset()
+
+
+def _get_named_collection(name: str) -> Optional[Collection]:
+    """
+    Return the (cached) collection with this name, or None if it doesn't exist.
+    
+    Cached handles (including "doesn't exist") are dropped as soon as any directory
+    is reindexed, even by another process or the CLI.
+    """
+    global _HANDLES_VERSION
+    versions = _index_versions()
+    with _handles_lock:
+        if versions != _HANDLES_VERSION:
+            if _HANDLES_VERSION is not None:
+                _reset_client()
+            _HANDLES_VERSION = versions
+        if name in _COLLECTIONS:
+            return _COLLECTIONS[name]
+    client = _get_client()
+    try:
+        collection = client.get_collection(name=name)
+    except Exception:
+        # Collection doesn't exist (ValueError or NotFoundError depending on chromadb version)
+        collection = None
+    with _handles_lock:
+        return _COLLECTIONS.setdefault(name, collection)
+
+
+def _get_collection(dir_name: str) -> Optional[Collection]:
+    """Return the (cached) collection for a directory, or None if it hasn't been indexed."""
+    return _get_named_collection(f"files_{dir_name}")
+
+
+def _reset_client():
+    """
+    Close this process's ChromaDB client and every collection handle, so the next
+    search reopens the index from disk. Call with _handles_lock held.
+    
+    Indexing updates collections in place, often from another process, and a live
+    client keeps serving the HNSW/metadata segments it already loaded. Chroma also
+    caches one system per path, so a new PersistentClient alone would reuse them.
+    """
+    global _CLIENT
+    if _CLIENT is not None:
+        # Clearing the cache below only forgets the system; stop it so its segment
+        # files and background threads are released rather than leaked
+        try:
+            _CLIENT._system.stop()
+        except Exception as e:
+            print(f"Warning: Could not stop ChromaDB client: {e}")
+    _CLIENT = None
+    _COLLECTIONS.clear()
+    _UNIFIED_DIRS.clear()
+    try:
+        from chromadb.api.client import SharedSystemClient
+        SharedSystemClient.clear_system_cache()
+    except (ImportError, AttributeError):
+        # Older chromadb without a shared system cache: a new client reloads anyway
+        pass
+
+
+def invalidate_collection():
+    """
+    Forget the cached ChromaDB handles after a reindex so searches see the updated
+    index. The client is shared by every directory and holds the loaded index
+    segments, so it is reopened as a whole rather than per directory.
+    """
+    if QUERY_SERVER_SOCKET:
+        # The handles live in the query server; tell it too (best effort)
+        try:
+            get_query_server_client().call("invalidate")
+        except Exception as e:
+            print(f"Warning: Could not invalidate query server collection cache: {e}")
+    _invalidate_local()
+
+
+def _invalidate_local():
+    """Drop this process's ChromaDB client and collection handles."""
+    with _handles_lock:
+        _reset_client()
+
+
+def get_collection_version(dir_name: str) -> str:
+    """
+    Opaque version of a directory's index; changes every time it is reindexed
+    (from any process). "0" if the directory has never been indexed.
+    """
+    try:
+        return str(os.stat(_version_file(dir_name)).st_mtime_ns)
+    except OSError:
+        return "0"
+
+
+def get_cached_embedding(query: str) -> np.ndarray:
+    """Return the (cached) embedding vector for a query with the current embedding model."""
+    return _embed_query(EMBEDDING_MODEL, query)
+
+
+def warmup(use_reranker: bool = True) -> None:
+    """
+    Load the embedding model (and reranker) and run one tiny inference through each,
+    so the first real search doesn't pay the model-load latency.
+    
+    Meant to be called once at process start, typically from a background thread.
+    Failures are printed and ignored; the models will just load on first use instead.
+    """
+    try:
+        get_model().encode(["warmup"], show_progress_bar=False)
+    except Exception as e:
+        print(f"Warning: Embedding model warmup failed: {e}")
+    if not use_reranker:
+        return
+    try:
+        _get_reranker().compute_score([["warmup", "warmup"]], normalize=True)
+    except Exception as e:
+        print(f"Warning: Reranker warmup failed: {e}")
+
+
+def _best_chunk_indices(
+    metadatas: List[dict],
+    distances: List[float],
+    top_k: Optional[int] = None
+) -> List[int]:
+    """
+    For each file path, find the index of its best (lowest-distance) chunk.
+    
+    Chroma query results come back sorted by distance, so the first chunk seen for
+    a path is its best one and a linear scan with a set is enough. Unsorted input
+    is stably sorted by distance first.
+    
+    Returns:
+        Indices into metadatas/distances, one per file, ordered by distance
+        (best matches first; ties by position) and limited to top_k files if given.
+    """
+    # Every chunk the indexer writes has a "path" in its metadata, so no checks here
+    n = min(len(metadatas), len(distances))
+    order = range(n)
+    # Skip the sort for already-sorted input (a vectorized check, no Python-level compares)
+    if n > 1 and np.any(np.diff(np.asarray(distances[:n], dtype=np.float64)) < 0):
+        # Sort chunks by distance (stable, so ties keep their original order), so the
+        # first occurrence of each path below is its LOWEST distance
+        order = sorted(order, key=distances.__getitem__)
+    seen = set()
+    best = []
+    for i in order:
+        path = metadatas[i]["path"]
+        if path in seen:
+            continue
+        seen.add(path)
+        best.append(i)
+        if top_k is not None and len(best) >= top_k:
+            break
+    return best
+
+
+def _merge_best_chunk_indices(
+    metadatas: List[dict],
+    distances: List[float],
+    starts: List[int],
+    top_k: Optional[int] = None
+) -> List[int]:
+    """
+    Like _best_chunk_indices, for results concatenated from several directories.
+    
+    Each directory's segment (starting at the offsets in starts) is aggregated on
+    its own, then the per-directory lists (each sorted by distance) are k-way merged,
+    keeping the first - i.e. lowest - occurrence of a path that appears in several.
+    Gives the same result as aggregating the concatenated lists in one go.
+    """
+    bounds = list(starts) + [len(metadatas)]
+    streams = [
+        [lo + i for i in _best_chunk_indices(metadatas[lo:hi], distances[lo:hi])]
+        for lo, hi in zip(bounds, bounds[1:])
+        if hi > lo
+    ]
+    # heapq.merge is stable: on equal distances, earlier directories come first
     seen = set()
-    out = []
-    for x in items:
-        if x not in seen:
-            seen.add(x)
-            out.append(x)
-    return out
+    best = []
+    for i in heapq.merge(*streams, key=lambda i: distances[i]):
+        path = metadatas[i]["path"]
+        if path in seen:
+            continue
+        seen.add(path)
+        best.append(i)
+        if top_k is not None and len(best) >= top_k:
+            break
+    return best
 
 
 def aggregate_best_chunk(
     metadatas: List[dict],
     distances: List[float],
-    documents: List[str]
+    documents: List[str],
+    top_k: Optional[int] = None
 ) -> Tuple[List[Dict[str, float]], Dict[str, str]]:
     """
     Aggregate chunks by file path, keeping the best (lowest) distance for each file.
@@ -31,41 +330,36 @@ def aggregate_best_chunk(
         metadatas: List of metadata dicts from ChromaDB query (contains "path" for each chunk)
         distances: List of distance values (lower = better match)
         documents: List of document text chunks from ChromaDB
+        top_k: If set, only the top_k best files are returned
     
     Returns:
         Tuple of:
         - List of dicts with 'path' and 'distance', sorted by distance
         - Dict mapping file paths to their best matching chunk text
     """
-    best_distances: Dict[str, float] = {}
+    n = min(len(metadatas), len(distances), len(documents))
+    result = []
     best_chunks: Dict[str, str] = {}
-    
-    for meta, dist, doc in zip(metadatas, distances, documents):
-        if not isinstance(meta, dict):
-            continue
-        path = meta.get("path")
-        if not path:
-            continue
-        
-        # Keep the LOWEST distance (best match) for each file
-        if path not in best_distances or dist < best_distances[path]:
-            best_distances[path] = dist
-            if doc:
-                best_chunks[path] = doc
-    
-    result = [{"path": path, "distance": dist} for path, dist in best_distances.items()]
-    result.sort(key=lambda x: x["distance"])
+    for i in _best_chunk_indices(metadatas[:n], distances[:n], top_k):
+        path = metadatas[i]["path"]
+        result.append({"path": path, "distance": float(distances[i])})
+        if documents[i]:
+            best_chunks[path] = documents[i]
     
     return result, best_chunks
 
 
-def aggregate_best_distance(metadatas: List[dict], distances: List[float]) -> List[Dict[str, float]]:
+def aggregate_best_distance(
+    metadatas: List[dict],
+    distances: List[float],
+    top_k: Optional[int] = None
+) -> List[Dict[str, float]]:
     """
     Aggregate chunks by file path, keeping the best (lowest) distance for each file.
     
     WHY THIS EXISTS:
     - ChromaDB returns results by CHUNK (pieces of files), not by FILE
-    - One file might have multiple matching chunks (e.g., "file.pdf::chunk-0", "file.pdf::chunk-5")
+    - One file might have multiple matching chunks (e.g., chunks 0 and 5 of "file.pdf")
     - We want to show each file only ONCE in results, with its BEST (lowest) distance
     
     Example:
@@ -75,36 +369,189 @@ def aggregate_best_distance(metadatas: List[dict], distances: List[float]) -> Li
     Args:
         metadatas: List of metadata dicts from ChromaDB query (contains "path" for each chunk)
         distances: List of distance values (lower = better match, e.g., 0.2 is better than 0.8)
+        top_k: If set, only the top_k best files are returned
     
     Returns:
         List of dicts with 'path' and 'distance', sorted by distance (best matches first)
     """
-    # Track best (lowest) distance per file path
-    # Key: file path (e.g., "documents1/file.pdf")
-    # Value: best distance found for that file
-    best_distances: Dict[str, float] = {}
+    return [
+        {"path": metadatas[i]["path"], "distance": float(distances[i])}
+        for i in _best_chunk_indices(metadatas, distances, top_k)
+    ]
+
+
+def _get_query_pool() -> ThreadPoolExecutor:
+    """Create the shared per-directory query pool on first use."""
+    global _QUERY_POOL
+    with _handles_lock:
+        if _QUERY_POOL is None:
+            _QUERY_POOL = ThreadPoolExecutor(max_workers=QUERY_WORKERS, thread_name_prefix="chroma-query")
+        return _QUERY_POOL
+
+
+def _local_query(
+    name: str,
+    q_emb: np.ndarray,
+    n_results: int,
+    where: Optional[dict] = None
+) -> Optional[Tuple[list, list, list]]:
+    """Query a collection in this process; None if it doesn't exist."""
+    collection = _get_named_collection(name)
+    if collection is None:
+        return None
     
-    # Loop through each chunk result
-    for meta, dist in zip(metadatas, distances):
-        if not isinstance(meta, dict):
-            continue
-        path = meta.get("path")  # e.g., "documents1/file.pdf"
-        if not path:
-            continue
-        
-        # Keep the LOWEST distance (best match) for each file
-        # If we've seen this file before with a worse distance, replace it
-        # If we haven't seen it, add it
-        if path not in best_distances or dist < best_distances[path]:
-            best_distances[path] = dist
+    # Query the vector database for similar chunks
+    kwargs = {"where": where} if where else {}
+    res = collection.query(
+        query_embeddings=q_emb,
+        n_results=n_results,
+        include=list(QUERY_INCLUDE),
+        **kwargs
+    )
     
-    # Convert dictionary to list of dicts: [{"path": "...", "distance": 0.2}, ...]
-    result = [{"path": path, "distance": dist} for path, dist in best_distances.items()]
+    # Extract metadata, distances, and chunk ids (ids are always returned)
+    metas = (res.get("metadatas") or [[]])[0]
+    distances = (res.get("distances") or [[]])[0]
+    ids = (res.get("ids") or [[]])[0]
+    return metas, distances, ids
+
+
+def _local_documents(name: str, ids: List[str]) -> Dict[str, str]:
+    """Fetch chunk texts by id from a collection in this process (id -> text)."""
+    collection = _get_named_collection(name)
+    if collection is None:
+        return {}
+    res = collection.get(ids=ids, include=["documents"])
+    # get() doesn't promise to return rows in the requested order, so key by id
+    return dict(zip(res.get("ids") or [], res.get("documents") or []))
+
+
+def _local_has_rows(name: str, where: dict) -> bool:
+    """Whether a collection in this process has any row matching where."""
+    collection = _get_named_collection(name)
+    if collection is None:
+        return False
+    return bool(collection.get(where=where, limit=1, include=[])["ids"])
+
+
+# The three collection operations search needs. They run against ChromaDB in this
+# process, or in the query server when SEMANTIC_QUERY_SERVER is set.
+
+def _collection_query(
+    name: str,
+    q_emb: np.ndarray,
+    n_results: int,
+    where: Optional[dict] = None
+) -> Optional[Tuple[list, list, list]]:
+    """(metadatas, distances, ids) of the chunks closest to q_emb; None if the collection doesn't exist."""
+    if QUERY_SERVER_SOCKET:
+        return get_query_server_client().query(name, q_emb, n_results, where)
+    return _local_query(name, q_emb, n_results, where)
+
+
+def _collection_documents(name: str, ids: List[str]) -> Dict[str, str]:
+    """Chunk texts for the given chunk ids (id -> text)."""
+    if QUERY_SERVER_SOCKET:
+        return get_query_server_client().call("documents", name, ids)
+    return _local_documents(name, ids)
+
+
+def _collection_has_rows(name: str, where: dict) -> bool:
+    """Whether the collection exists and has any row matching where."""
+    if QUERY_SERVER_SOCKET:
+        return get_query_server_client().call("has_rows", name, where)
+    return _local_has_rows(name, where)
+
+
+def _query_one(
+    dir_name: str,
+    q_emb: np.ndarray,
+    n_results: int
+) -> Tuple[list, list, list, Optional[str]]:
+    """
+    Query one directory's collection for the chunks closest to q_emb.
+    
+    Returns:
+        (metadatas, distances, ids, collection name); the lists are empty if the
+        directory has no collection or no results. Chunk texts aren't fetched here
+        (see _fetch_chunk_texts).
+    """
+    name = f"files_{dir_name}"
+    # Check if collection exists, skip if it doesn't
+    res = _collection_query(name, q_emb, n_results)
+    if res is None:
+        return [], [], [], None
+    
+    metas, distances, ids = res
+    if not metas or not distances:
+        return [], [], [], None
+    return metas, distances, ids, name
+
+
+def _search_files_unified(
+    q_emb: np.ndarray,
+    directories: List[str],
+    n_results: int
+) -> Optional[Tuple[list, list, list, Optional[str]]]:
+    """
+    Query every directory at once through the shared collection (SEMANTIC_UNIFIED_COLLECTION=1).
+    
+    Returns:
+        (metadatas, distances, ids, collection name) like _query_one, or None if the
+        shared collection doesn't exist or any directory isn't mirrored into it yet
+        (the caller then falls back to querying each directory's own collection).
+    """
+    for dir_name in directories:
+        with _handles_lock:
+            present = _UNIFIED_DIRS.get(dir_name)
+        if present is None:
+            present = _collection_has_rows(UNIFIED_COLLECTION_NAME, {"dir": dir_name})
+            with _handles_lock:
+                _UNIFIED_DIRS[dir_name] = present
+        if not present:
+            return None
+    
+    where = {"dir": directories[0]} if len(directories) == 1 else {"dir": {"$in": directories}}
+    res = _collection_query(UNIFIED_COLLECTION_NAME, q_emb, n_results * len(directories), where)
+    if res is None:
+        return None
+    metas, distances, ids = res
+    if not metas or not distances:
+        return [], [], [], None
+    return metas, distances, ids, UNIFIED_COLLECTION_NAME
+
+
+def _fetch_chunk_texts(
+    best: List[int],
+    metadatas: List[dict],
+    ids: List[str],
+    owners: List[str]
+) -> Dict[str, str]:
+    """
+    Second retrieval phase: fetch the text of only the chunks that will be reranked.
     
-    # Sort by distance (lowest first = best matches first)
-    result.sort(key=lambda x: x["distance"])
+    Args:
+        best: Indices (into the other lists) of each candidate file's best chunk
+        metadatas: Chunk metadata dicts (contain "path")
+        ids: Chunk ids
+        owners: Name of the collection each chunk came from
     
-    return result
+    Returns:
+        Dict mapping file paths to their best matching chunk text
+    """
+    # One fetch per collection the surviving chunks came from
+    by_owner: Dict[str, List[int]] = {}
+    for i in best:
+        by_owner.setdefault(owners[i], []).append(i)
+    
+    chunk_texts: Dict[str, str] = {}
+    for name, indices in by_owner.items():
+        doc_by_id = _collection_documents(name, [ids[i] for i in indices])
+        for i in indices:
+            doc = doc_by_id.get(ids[i])
+            if doc:
+                chunk_texts[metadatas[i]["path"]] = doc
+    return chunk_texts
 
 
 def search_files(
@@ -112,7 +559,8 @@ def search_files(
     k: int = 5,
     directory: str | List[str] = "documents1",
     include_distances: bool = False,
-    use_reranker: bool = True
+    use_reranker: bool = True,
+    distance_threshold: Optional[float] = None
 ) -> List:
     """
     Search for files matching a query using semantic similarity, optionally with reranking.
@@ -125,6 +573,8 @@ def search_files(
         include_distances: If True, return list of dicts with 'path' and 'distance'. 
                           If False, return list of paths (backward compatible)
         use_reranker: If True, use reranker to improve ranking accuracy (default: True)
+        distance_threshold: If set, only files whose best chunk distance is <= this value
+                            are returned (lower = better match)
     
     Returns:
         If include_distances=False: List of file paths (relative to project root)
@@ -139,78 +589,94 @@ def search_files(
     if not query or k <= 0:
         return []
     
-    # Connect to ChromaDB
-    client = chromadb.PersistentClient(path=str(CHROMA_DIR))
+    # Convert query to embedding vector (do this once, reuse for all directories).
+    # Cached per query string, so repeat searches skip re-embedding.
+    q_emb = get_cached_embedding(query)
     
-    # Convert query to embedding vector (do this once, reuse for all directories)
-    # Use normalized embeddings to match how documents were indexed, so that
-    # cosine-distance-based similarity behaves as expected.
-    model = get_model()
-    q_emb = model.encode([query], normalize_embeddings=True).tolist()
-    
-    # Collect results from all directories
-    all_metas = []
-    all_distances = []
-    all_documents = []
+    # Fetch more results if using reranker (we'll rerank and then limit to k) so it
+    # has some diversity to work with; recall itself comes from the collection's
+    # hnsw:search_ef, not from overfetching. With a threshold, oversample so enough
+    # files survive the filter. The reranker's pool stays capped at 50 chunks.
+    if use_reranker:
+        n_results = min(k * 2, 50)
+    else:
+        n_results = k * 2 if distance_threshold is not None else k
     
-    for dir_name in directories:
-        collection_name = f"files_{dir_name}"
-        
-        # Check if collection exists, skip if it doesn't
-        try:
-            collection = client.get_collection(name=collection_name)
-        except Exception:
-            continue
-        
-        # Query the vector database for similar chunks
-        # Include documents if we're using reranker
-        include_list = ["metadatas", "distances"]
-        if use_reranker:
-            include_list.append("documents")
-        
-        # Fetch more results if using reranker (we'll rerank and then limit to k)
-        n_results = min(k * 3, 50) if use_reranker else k
-        res = collection.query(
-            query_embeddings=q_emb,
-            n_results=n_results,
-            include=include_list
-        )
-        
-        # Extract metadata, distances, and documents
-        metas = (res.get("metadatas") or [[]])[0]
-        distances = (res.get("distances") or [[]])[0]
-        documents = (res.get("documents") or [[]])[0] if use_reranker else []
-        
-        if metas and distances:
-            all_metas.extend(metas)
-            all_distances.extend(distances)
-            if documents:
-                all_documents.extend(documents)
+    dir_starts = None  # Set when results are concatenated from several per-directory queries
+    if len(directories) == 1:
+        # Common case: one directory, so query it directly (no thread pool, nothing to merge)
+        all_metas, all_distances, all_ids, owner = _query_one(directories[0], q_emb, n_results)
+        all_owners = [owner] * len(all_ids)
+    else:
+        # Unified mode: one query against the shared collection covers every directory
+        unified = _search_files_unified(q_emb, directories, n_results) if UNIFIED_COLLECTION else None
+        if unified is not None:
+            all_metas, all_distances, all_ids, owner = unified
+            all_owners = [owner] * len(all_ids)
+        else:
+            # Query all directories concurrently (Chroma releases the GIL while it searches),
+            # then collect the results in directory order
+            per_dir = _get_query_pool().map(
+                lambda dir_name: _query_one(dir_name, q_emb, n_results), directories
+            )
+            all_metas = []
+            all_distances = []
+            all_ids = []
+            all_owners = []
+            dir_starts = []  # Where each directory's chunks start in the merged lists
+            for metas, distances, ids, owner in per_dir:
+                dir_starts.append(len(all_metas))
+                all_metas.extend(metas)
+                all_distances.extend(distances)
+                all_ids.extend(ids)
+                all_owners.extend([owner] * len(ids))
     
     if not all_metas or not all_distances:
         return []
     
-    # Aggregate: convert chunk-level results to file-level results
-    if use_reranker and all_documents:
-        aggregated, chunk_texts = aggregate_best_chunk(all_metas, all_distances, all_documents)
+    # Drop chunks beyond the distance threshold before aggregating/reranking.
+    # A file's best distance passes iff at least one of its chunks passes, so
+    # filtering at chunk level is equivalent and keeps the reranker's input small.
+    if distance_threshold is not None:
+        keep = np.flatnonzero(np.asarray(all_distances, dtype=np.float64) <= distance_threshold)
+        all_metas = [all_metas[i] for i in keep]
+        all_distances = [all_distances[i] for i in keep]
+        all_ids = [all_ids[i] for i in keep]
+        all_owners = [all_owners[i] for i in keep]
+        if not all_metas:
+            return []
+        if dir_starts is not None:
+            dir_starts = np.searchsorted(keep, dir_starts).tolist()
+    
+    # Aggregate: convert chunk-level results to file-level results.
+    # The reranker gets the best 2*k candidate files; otherwise only the top k are built.
+    top_files = k * 2 if use_reranker else k
+    if dir_starts is not None:
+        best = _merge_best_chunk_indices(all_metas, all_distances, dir_starts, top_k=top_files)
     else:
-        aggregated = aggregate_best_distance(all_metas, all_distances)
-        chunk_texts = {}
+        best = _best_chunk_indices(all_metas, all_distances, top_k=top_files)
+    hits = [Hit(all_metas[i]["path"], float(all_distances[i])) for i in best]
+    
+    # Two-phase retrieval: the query above skipped chunk texts, so fetch them now,
+    # only for the best chunk of each candidate file
+    chunk_texts = _fetch_chunk_texts(best, all_metas, all_ids, all_owners) if use_reranker else {}
     
     # Apply reranking if enabled
     if use_reranker and chunk_texts:
-        aggregated = rerank_files(query, aggregated, chunk_texts, top_k=k)
-    elif use_reranker and not chunk_texts:
+        # The reranker annotates result dicts with rerank_score, so convert here
+        aggregated = rerank_files(query, [hit._asdict() for hit in hits], chunk_texts, top_k=k)
+        if include_distances:
+            return aggregated
+        return [item["path"] for item in aggregated]
+    if use_reranker:
         # Reranker was requested but no chunk texts available
         print(f"Warning: Reranker requested but no chunk texts available (documents were not retrieved)")
-        aggregated = aggregated[:k]
-    else:
-        # Limit to k results (already sorted by distance, best matches first)
-        aggregated = aggregated[:k]
+    # Limit to k results (already sorted by distance, best matches first)
+    hits = hits[:k]
     
     if include_distances:
         # Return list of dicts: [{"path": "file.pdf", "distance": 0.2}, ...]
-        return aggregated
+        return [hit._asdict() for hit in hits]
     else:
         # Return just paths for backward compatibility: ["file.pdf", "file2.pdf", ...]
-        return [item["path"] for item in aggregated]
+        return [hit.path for hit in hits]
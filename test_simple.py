@@ -40,9 +40,9 @@ print("TEST 2: Distance Threshold - Filter out irrelevant results")
 
 # Test search for something unrelated to linear algebra
 test_query = "rhetoric"  # Should not match
-#test_query = "linear algebra" # Uhhh this gives ~1.1 but probably because textbook is too big? Any ideas?
-#test_query = "determinant" # Around 1.1 
-#test_query = "matrix" # Around 1.2 
+#test_query = "linear algebra" # Uhhh this gives ~0.55 but probably because textbook is too big? Any ideas?
+#test_query = "determinant" # Around 0.55 
+#test_query = "matrix" # Around 0.6 
 # Maybe too much inside of the textbook so unless the entire textbook talks about it it's not close? 
 # I don't know a single query that would match the textbook
 print(f"Searching for: '{test_query}'")
@@ -55,8 +55,9 @@ for r in all_results["results"][:5]:
     print(f"  {filename}: distance={r['distance']:.3f}")
 
 # Search WITH threshold (filter out bad matches)
-print(f"\nWith threshold (distance <= 0.4):")
-filtered = requests.get(f"{BASE_URL}/search?q={test_query}&dir=documents2&include_scores=true&distance_threshold=0.4").json()
+# Distances are 1 - cosine similarity (0-2); 0.2 here is the old squared-L2 cutoff of 0.4
+print(f"\nWith threshold (distance <= 0.2):")
+filtered = requests.get(f"{BASE_URL}/search?q={test_query}&dir=documents2&include_scores=true&distance_threshold=0.2").json()
 print(f"  {len(filtered['results'])} results")
 for r in filtered["results"]:
     filename = r['path'].split('/')[-1]